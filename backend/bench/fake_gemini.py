@@ -0,0 +1,129 @@
+"""Stand-in for the Gemini model object planner.py calls.
+
+Swap it in with `planner.model = FakeGeminiModel(...)`. It answers the parse,
+whole-itinerary and per-day prompts with schema-shaped JSON, paced by a time
+to first token and an output token rate, and can inject upstream errors and
+truncated JSON.
+"""
+import asyncio
+import json
+import random
+import re
+
+from google.api_core import exceptions as google_exceptions
+
+from extract import extractor
+from schemas import DAY_SCHEMA, ITINERARY_SCHEMA, PARSED_INPUT_SCHEMA
+
+# Rough size of one output token, used to pace text by token rate
+CHARS_PER_TOKEN = 4
+TIMES = ["09:00", "11:30", "13:00", "14:30", "16:30", "19:00"]
+CATEGORIES = ["hidden_gem", "film", "dining", "fashion", "music", "dining"]
+
+TRIP_RE = re.compile(r"(\d+)-day cultural itinerary in (.+?)[\s(.]")
+DAY_RE = re.compile(r"This is day (\d+) of a")
+
+
+class FakeUsage:
+    def __init__(self, prompt, text):
+        self.prompt_token_count = len(prompt) // CHARS_PER_TOKEN
+        self.candidates_token_count = len(text) // CHARS_PER_TOKEN
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeStreamResponse:
+    def __init__(self, chunks, seconds_per_chunk, usage_metadata):
+        self.chunks = chunks
+        self.seconds_per_chunk = seconds_per_chunk
+        self.usage_metadata = usage_metadata
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for i, chunk in enumerate(self.chunks, 1):
+            await asyncio.sleep(self.seconds_per_chunk)
+            # Like the real stream, only the last chunk reports usage
+            yield FakeResponse(chunk, self.usage_metadata if i == len(self.chunks) else None)
+
+
+class FakeGeminiModel:
+    def __init__(self, first_token=0.4, tokens_per_second=200.0, failure_rate=0.0,
+                 bad_json_rate=0.0, chunk_tokens=16, seed=None):
+        self.first_token = first_token
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.bad_json_rate = bad_json_rate
+        self.chunk_tokens = chunk_tokens
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+
+    async def generate_content_async(self, prompt, stream=False, generation_config=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.first_token)
+        if self.random.random() < self.failure_rate:
+            self.failures += 1
+            raise self.random.choice([
+                google_exceptions.ResourceExhausted("injected failure"),
+                google_exceptions.ServiceUnavailable("injected failure"),
+            ])
+
+        text = self._answer(prompt, getattr(generation_config, "response_schema", None))
+        if self.random.random() < self.bad_json_rate:
+            text = text[: len(text) // 2]
+
+        usage = FakeUsage(prompt, text)
+        chunk_chars = self.chunk_tokens * CHARS_PER_TOKEN
+        seconds_per_chunk = self.chunk_tokens / self.tokens_per_second
+        if stream:
+            chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+            return FakeStreamResponse(chunks, seconds_per_chunk, usage)
+        await asyncio.sleep(len(text) / CHARS_PER_TOKEN / self.tokens_per_second)
+        return FakeResponse(text, usage)
+
+    def _answer(self, prompt, schema):
+        if schema is PARSED_INPUT_SCHEMA:
+            return json.dumps(self._parse(prompt))
+        match = TRIP_RE.search(prompt)
+        days, city = (int(match.group(1)), match.group(2)) if match else (2, "Tokyo")
+        if schema is DAY_SCHEMA:
+            day_match = DAY_RE.search(prompt)
+            return json.dumps(self._day(int(day_match.group(1)) if day_match else 1, city))
+        if schema is not ITINERARY_SCHEMA:
+            raise ValueError("fake model only serves planner's JSON-mode prompts")
+        return json.dumps({"itinerary": {
+            "destination": city,
+            "duration": days,
+            "days": [self._day(day, city) for day in range(1, days + 1)],
+        }})
+
+    def _parse(self, prompt):
+        user_input = prompt.split('User input: "', 1)[-1].rsplit('"', 1)[0]
+        found = extractor.extract(user_input)
+        return {
+            "music": found.music or "BTS",
+            "movie": found.movie or "Spirited Away",
+            "fashion": found.fashion or "Uniqlo",
+            "destination": found.destination or "Tokyo",
+            "days": found.days or 2,
+        }
+
+    def _day(self, day, city):
+        # Venues are unique per day so the per-day repeat check never retries
+        return {
+            "day": day,
+            "theme": f"Day {day} in {city}",
+            "activities": [{
+                "time": time,
+                "location": f"{city} {category.replace('_', ' ')} spot {day}-{i}",
+                "category": category,
+                "description": f"A stand-in {category} stop for load testing.",
+                "cultural_connection": "Ties the day's spotlight tastes to the neighbourhood.",
+            } for i, (time, category) in enumerate(zip(TIMES, CATEGORIES), 1)],
+        }
@@ -0,0 +1,103 @@
+"""Local stand-in for the Qloo /search and /recommendations/* endpoints.
+
+    python -m bench.fake_qloo --port 8701 --latency 0.15 --failure-rate 0.05
+
+Point the backend at it with QLOO_BASE_URL=http://127.0.0.1:8701.
+"""
+import argparse
+import asyncio
+import random
+
+from aiohttp import web
+
+# Like the real hackathon API, only one path per domain returns results;
+# the other variants 404 so the backend's variant racing is exercised
+ANSWERING_VARIANTS = {"artists", "films", "brands"}
+
+
+class FakeQloo:
+    def __init__(self, latency=0.15, jitter=0.05, failure_rate=0.0, miss_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.miss_rate = miss_rate
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+
+    async def _delay(self):
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+
+    def _failure(self):
+        if self.random.random() < self.failure_rate:
+            self.failures += 1
+            status = self.random.choice([429, 500, 503])
+            return web.json_response({"error": "injected failure"}, status=status)
+        return None
+
+    async def search(self, request):
+        await self._delay()
+        failure = self._failure()
+        if failure is not None:
+            return failure
+        query = request.query.get("query", "")
+        if not query or self.random.random() < self.miss_rate:
+            return web.json_response({"results": []})
+        slug = query.lower().replace(" ", "-")
+        return web.json_response({"results": [{
+            "entity_id": f"fake-{slug}",
+            "name": query,
+            "tags": [
+                {"type": "urn:tag:genre:qloo", "name": f"{slug}_style"},
+                {"type": "urn:tag:influenced_by:qloo", "name": f"{slug}_roots"},
+            ],
+        }]})
+
+    async def recommendations(self, request):
+        await self._delay()
+        failure = self._failure()
+        if failure is not None:
+            return failure
+        variant = request.match_info["variant"]
+        if variant not in ANSWERING_VARIANTS:
+            return web.json_response({"error": "unknown domain"}, status=404)
+        payload = await request.json()
+        seed = (payload.get("ids") or ["none"])[0]
+        count = payload.get("count", 5)
+        return web.json_response({"recommendations": [
+            {"name": f"{seed} {variant} pick {i}"} for i in range(1, count + 1)
+        ]})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/search", self.search)
+        app.router.add_post("/recommendations/{variant}", self.recommendations)
+        return app
+
+
+async def start_fake_qloo(fake, host="127.0.0.1", port=0):
+    """Start serving in the running loop; returns (runner, base_url)"""
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8701)
+    parser.add_argument("--latency", type=float, default=0.15, help="mean seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.05, help="latency standard deviation")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction answered with 429/5xx")
+    parser.add_argument("--miss-rate", type=float, default=0.0, help="fraction of searches with no results")
+    args = parser.parse_args()
+    fake = FakeQloo(args.latency, args.jitter, args.failure_rate, args.miss_rate)
+    web.run_app(fake.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
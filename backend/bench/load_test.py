@@ -0,0 +1,251 @@
+"""Load test /generate-itinerary against local Qloo and Gemini stand-ins.
+
+    python -m bench.load_test --requests 200 --concurrency 20
+    python -m bench.load_test --stream --gemini-failure-rate 0.05
+    python -m bench.load_test --max-blocked 0.05 --max-p95 8   # fail on regressions
+
+The app runs in-process on its own thread and event loop, with planner.model
+swapped for the fake Gemini and QLOO_BASE_URL pointed at the fake Qloo. A
+probe on the server loop records how long the loop was blocked, which is
+what a sync call reintroduced into the pipeline shows up as.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+import httpx
+import uvicorn
+
+from bench.fake_gemini import FakeGeminiModel
+from bench.fake_qloo import FakeQloo, start_fake_qloo
+from bench.parse_bench import CORPUS, percentile
+
+
+class LoopMonitor:
+    """Sleeps in short ticks and counts any overshoot as time the loop was blocked"""
+
+    def __init__(self, interval=0.01, threshold=0.005):
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - start - self.interval
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                self.blocked += lag
+                self.stalls += 1
+
+    def reset(self):
+        self.blocked = self.max_lag = 0.0
+        self.stalls = 0
+
+
+class ServerThread(threading.Thread):
+    """Fake Qloo plus the FastAPI app, served from one background event loop"""
+
+    def __init__(self, args):
+        super().__init__(daemon=True)
+        self.args = args
+        self.monitor = LoopMonitor()
+        self.ready = threading.Event()
+        self.error = None
+        self.server = None
+        self.fake_qloo = FakeQloo(args.qloo_latency, args.qloo_jitter, args.qloo_failure_rate,
+                                  args.qloo_miss_rate, args.seed)
+        self.fake_gemini = FakeGeminiModel(args.gemini_first_token, args.gemini_tokens_per_second,
+                                           args.gemini_failure_rate, args.gemini_bad_json_rate, seed=args.seed)
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except BaseException as e:
+            self.error = e
+            self.ready.set()
+
+    async def serve(self):
+        qloo_runner, qloo_url = await start_fake_qloo(self.fake_qloo)
+        # planner reads its configuration at import time
+        os.environ["QLOO_BASE_URL"] = qloo_url
+        os.environ.setdefault("QLOO_API_KEY", "bench")
+        os.environ.setdefault("GOOGLE_API_KEY", "bench")
+        if not self.args.warm:
+            os.environ["ITINERARY_CACHE_SIZE"] = "0"
+            os.environ["QLOO_CACHE_SIZE"] = "0"
+            os.environ["CACHE_DB_PATH"] = ""
+        import planner
+        from main import app
+        planner.model = self.fake_gemini
+
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.args.port, log_level="warning",
+                                access_log=False, lifespan="on")
+        self.server = uvicorn.Server(config)
+        # Signals can only be handled on the main thread
+        self.server.install_signal_handlers = lambda: None
+        monitor = asyncio.create_task(self.monitor.run())
+        serving = asyncio.create_task(self.server.serve())
+        while not self.server.started and not serving.done():
+            await asyncio.sleep(0.05)
+        if serving.done():
+            await serving
+        self.ready.set()
+        try:
+            await serving
+        finally:
+            monitor.cancel()
+            await qloo_runner.cleanup()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.should_exit = True
+        self.join(timeout=10)
+
+
+def make_prompts(count):
+    """Corpus prompts, varied by trip length so cold runs don't repeat a request"""
+    prompts = []
+    for i in range(count):
+        prompt = CORPUS[i % len(CORPUS)][0]
+        prompts.append(f"{prompt} (trip {i // len(CORPUS) + 1}, {i % 6 + 2} days)")
+    return prompts
+
+
+def parse_server_timing(header):
+    stages = {}
+    for part in header.split(","):
+        name, _, dur = part.strip().partition(";dur=")
+        if dur:
+            stages[name] = float(dur) / 1000
+    return stages
+
+
+async def one_request(client, path, prompt, stream):
+    start = time.perf_counter()
+    if stream:
+        first_day, last_line = None, ""
+        async with client.stream("POST", path, json={"user_input": prompt}) as response:
+            async for line in response.aiter_lines():
+                if first_day is None and '"type": "day"' in line:
+                    first_day = time.perf_counter() - start
+                last_line = line or last_line
+            ok = response.status_code == 200 and '"type": "done"' in last_line
+            return response.status_code, ok, time.perf_counter() - start, first_day, {}
+    response = await client.post(path, json={"user_input": prompt})
+    ok = response.status_code == 200 and response.json().get("status") == "success"
+    stages = parse_server_timing(response.headers.get("server-timing", ""))
+    return response.status_code, ok, time.perf_counter() - start, None, stages
+
+
+async def drive(args, base_url, monitor):
+    path = "/generate-itinerary/stream" if args.stream else "/generate-itinerary"
+    prompts = make_prompts(args.requests)
+    queue = asyncio.Queue()
+    for prompt in prompts:
+        queue.put_nowait(prompt)
+    results = []
+
+    async def worker(client):
+        while not queue.empty():
+            prompt = queue.get_nowait()
+            try:
+                results.append(await one_request(client, path, prompt, args.stream))
+            except httpx.HTTPError as e:
+                results.append((type(e).__name__, False, None, None, {}))
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        # Warm-up request keeps one-off import/connection costs out of the numbers
+        await one_request(client, path, "warm up, 2 days in Tokyo", args.stream)
+        monitor.reset()
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(client) for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def report(args, results, elapsed, server):
+    monitor = server.monitor
+    latencies = [r[2] for r in results if r[2] is not None]
+    ok = sum(1 for r in results if r[1])
+    statuses = Counter(str(r[0]) for r in results)
+
+    print(f"requests: {len(results)}  concurrency: {args.concurrency}  "
+          f"mode: {'stream' if args.stream else 'json'}  caches: {'warm' if args.warm else 'off'}")
+    print(f"succeeded: {ok}/{len(results)}  statuses: {dict(statuses)}")
+    print(f"throughput: {len(results) / elapsed:.1f} req/s over {elapsed:.1f}s")
+    if latencies:
+        print(f"latency: p50 {percentile(latencies, 50):.3f}s  p95 {percentile(latencies, 95):.3f}s  "
+              f"p99 {percentile(latencies, 99):.3f}s  max {max(latencies):.3f}s")
+    first_days = [r[3] for r in results if r[3] is not None]
+    if first_days:
+        print(f"first day: p50 {percentile(first_days, 50):.3f}s  p95 {percentile(first_days, 95):.3f}s")
+    stage_times = {}
+    for r in results:
+        for name, seconds in r[4].items():
+            stage_times.setdefault(name, []).append(seconds)
+    for name, values in stage_times.items():
+        print(f"  {name:<12} mean {statistics.mean(values) * 1000:.0f}ms  p95 {percentile(values, 95) * 1000:.0f}ms")
+    print(f"event loop blocked: {monitor.blocked * 1000:.0f}ms total in {monitor.stalls} stalls "
+          f"(> {monitor.threshold * 1000:.0f}ms), max lag {monitor.max_lag * 1000:.1f}ms")
+    print(f"upstream: qloo {server.fake_qloo.requests} requests ({server.fake_qloo.failures} failed), "
+          f"gemini {server.fake_gemini.calls} calls ({server.fake_gemini.failures} failed)")
+
+    failures = []
+    if args.max_blocked is not None and monitor.blocked > args.max_blocked:
+        failures.append(f"event loop blocked {monitor.blocked:.3f}s > {args.max_blocked}s")
+    if args.max_p95 is not None and latencies and percentile(latencies, 95) > args.max_p95:
+        failures.append(f"p95 {percentile(latencies, 95):.3f}s > {args.max_p95}s")
+    if args.min_success is not None and ok / len(results) < args.min_success:
+        failures.append(f"success rate {ok / len(results):.3f} < {args.min_success}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--stream", action="store_true", help="drive the NDJSON endpoint instead")
+    parser.add_argument("--warm", action="store_true", help="keep the itinerary and Qloo caches enabled")
+    parser.add_argument("--port", type=int, default=8702)
+    parser.add_argument("--timeout", type=float, default=120, help="client timeout per request")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--qloo-latency", type=float, default=0.15)
+    parser.add_argument("--qloo-jitter", type=float, default=0.05)
+    parser.add_argument("--qloo-failure-rate", type=float, default=0.0)
+    parser.add_argument("--qloo-miss-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-first-token", type=float, default=0.4, help="seconds before output starts")
+    parser.add_argument("--gemini-tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--gemini-failure-rate", type=float, default=0.0, help="fraction raising 429/503")
+    parser.add_argument("--gemini-bad-json-rate", type=float, default=0.0, help="fraction truncated mid-JSON")
+    parser.add_argument("--max-blocked", type=float, default=None, help="fail if the loop blocked longer (s)")
+    parser.add_argument("--max-p95", type=float, default=None, help="fail if p95 latency exceeds this (s)")
+    parser.add_argument("--min-success", type=float, default=None, help="fail below this success ratio")
+    args = parser.parse_args()
+
+    server = ServerThread(args)
+    server.start()
+    server.ready.wait()
+    if server.error is not None:
+        raise server.error
+    try:
+        results, elapsed = asyncio.run(drive(args, f"http://127.0.0.1:{args.port}", server.monitor))
+    finally:
+        server.stop()
+    sys.exit(0 if report(args, results, elapsed, server) else 1)
+
+
+if __name__ == "__main__":
+    main()
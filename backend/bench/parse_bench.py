@@ -0,0 +1,139 @@
+"""Compare the local fast-path extractor with the Gemini parse.
+
+    python -m bench.parse_bench            # extractor vs the labelled corpus
+    python -m bench.parse_bench --llm      # also run Gemini (needs GOOGLE_API_KEY)
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from extract import extractor
+
+FIELDS = ["music", "movie", "fashion", "destination", "days"]
+
+# (prompt, expected music, movie, fashion, destination, days)
+CORPUS = [
+    ("I'm a huge BTS fan, love Spirited Away and Uniqlo basics. 3 days in Tokyo please",
+     "BTS", "Spirited Away", "Uniqlo", "Tokyo", 3),
+    ("Planning a week in Paris. Into Daft Punk, Amélie and Chanel",
+     "Daft Punk", "Amélie", "Chanel", "Paris", 7),
+    ("Weekend in Seoul! BLACKPINK, Parasite, Gentle Monster sunglasses",
+     "BLACKPINK", "Parasite", "Gentle Monster", "Seoul", 2),
+    ("5 days in New York City - Taylor Swift, La La Land and Supreme",
+     "Taylor Swift", "La La Land", "Supreme", "New York", 5),
+    ("Two days in Kyoto, I like Joe Hisaishi, My Neighbor Totoro and Muji",
+     "Joe Hisaishi", "My Neighbor Totoro", "Muji", "Kyoto", 2),
+    ("Flying from London to Berlin for four days, Radiohead, Inception, COS",
+     "Radiohead", "Inception", "COS", "Berlin", 4),
+    ("K-pop lover, Studio Ghibli fan, minimalist style, 3 days in Osaka",
+     "BTS", "Spirited Away", "Uniqlo", "Osaka", 3),
+    ("6 nights in Mexico City, Bad Bunny, Coco and Levi's",
+     "Bad Bunny", "Coco", "Levi's", "Mexico City", 6),
+    ("Hong Kong trip for 3 days, In the Mood for Love, Hikaru Utada, Comme des Garcons",
+     "Hikaru Utada", "In the Mood for Love", "Comme des Garçons", "Hong Kong", 3),
+    ("visit Rome for 2 days, Roman Holiday vibes, Adele, Gucci",
+     "Adele", "Roman Holiday", "Gucci", "Rome", 2),
+    ("I want to explore Mumbai for 4 days. A. R. Rahman, Slumdog Millionaire and Sacai",
+     "A. R. Rahman", "Slumdog Millionaire", "Sacai", "Mumbai", 4),
+    ("Lisbon, one week, Coldplay, Before Sunrise, Arket",
+     "Coldplay", "Before Sunrise", "Arket", "Lisbon", 7),
+    ("jazz, anime and streetwear in Tokyo for a long weekend",
+     "Miles Davis", "Your Name", "BAPE", "Tokyo", 2),
+    ("Something cultural, 3 days, I love indie films and thrifted clothes",
+     None, None, None, None, 3),
+    ("Take me somewhere fun, I listen to Fleetwood Mac and wear Carhartt",
+     "Fleetwood Mac", None, "Carhartt", None, None),
+]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def field_matches(got, expected):
+    if expected is None:
+        return True
+    if isinstance(expected, int):
+        return got == expected
+    return got is not None and str(got).casefold() == expected.casefold()
+
+
+async def run(args):
+    # Build the automaton outside the timed loop, as the server does on first request
+    extractor.extract("warm up")
+
+    fast_times, fast_results = [], []
+    for prompt, *_ in CORPUS:
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = extractor.extract(prompt)
+            fast_times.append(time.perf_counter() - start)
+        fast_results.append(result)
+
+    correct = {field: 0 for field in FIELDS}
+    labelled = {field: 0 for field in FIELDS}
+    accepted = accepted_correct = 0
+    for (prompt, *expected), result in zip(CORPUS, fast_results):
+        row_ok = True
+        for field, want in zip(FIELDS, expected):
+            if want is None:
+                continue
+            labelled[field] += 1
+            ok = field_matches(getattr(result, field), want)
+            correct[field] += ok
+            row_ok &= ok
+        if result.confidence >= args.threshold:
+            accepted += 1
+            accepted_correct += row_ok
+        if args.verbose:
+            print(f"{result.confidence:.2f}  {prompt[:60]!r} -> {result.as_tuple()}")
+
+    print(f"prompts: {len(CORPUS)}  fast-path threshold: {args.threshold}")
+    print("fast extractor accuracy vs labels:")
+    for field in FIELDS:
+        if labelled[field]:
+            print(f"  {field:<12} {correct[field]}/{labelled[field]}")
+    print(f"fast-path coverage: {accepted}/{len(CORPUS)} "
+          f"({accepted_correct} of those fully correct)")
+    print(f"fast extractor latency: mean {statistics.mean(fast_times) * 1e6:.0f}us "
+          f"p95 {percentile(fast_times, 95) * 1e6:.0f}us")
+
+    if not args.llm:
+        return
+
+    # Imported lazily: planner configures the Gemini client on import
+    from planner import parse_with_llm
+
+    llm_times, agree, compared = [], 0, 0
+    for (prompt, *_), fast in zip(CORPUS, fast_results):
+        start = time.perf_counter()
+        llm = await parse_with_llm(prompt)
+        llm_times.append(time.perf_counter() - start)
+        # Only prompts that would take the fast path matter for agreement
+        if fast.confidence >= args.threshold:
+            for got, want in zip(fast.as_tuple(), llm):
+                compared += 1
+                agree += field_matches(got, want)
+
+    mean_llm = statistics.mean(llm_times)
+    print(f"agreement with Gemini parse on fast-path prompts: {agree}/{compared} fields")
+    print(f"Gemini parse latency: mean {mean_llm * 1000:.0f}ms p95 {percentile(llm_times, 95) * 1000:.0f}ms")
+    print(f"latency saved per request: {accepted / len(CORPUS) * mean_llm * 1000:.0f}ms on average "
+          f"({mean_llm * 1000:.0f}ms on each fast-path hit)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm", action="store_true", help="also call Gemini for comparison")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("FAST_PARSE_MIN_CONFIDENCE", 0.9)),
+                        help="fast-path confidence threshold")
+    parser.add_argument("--repeat", type=int, default=200, help="timing repetitions per prompt")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
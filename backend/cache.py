@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(*parts):
+    """Stable hash for any JSON-serialisable key material"""
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    """In-process LRU where every entry also expires after its TTL"""
+
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (value, time.monotonic() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+class SqliteCache:
+    """On-disk tier that survives restarts. Values are stored as JSON, one
+    namespace per cache so several caches can share a file."""
+
+    def __init__(self, path, namespace):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            self._conn.execute(
+                "DELETE FROM cache WHERE namespace = ? AND expires < ?", (namespace, time.time())
+            )
+
+    def _get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM cache WHERE namespace = ? AND key = ?",
+                (self.namespace, key),
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None, 0
+        return json.loads(row[0]), row[1] - time.time()
+
+    def _set(self, key, value, ttl):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value, ensure_ascii=False), time.time() + ttl),
+            )
+
+    async def get(self, key):
+        """Returns (value, remaining ttl); value is None on a miss"""
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key, value, ttl):
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+
+class TieredCache:
+    """Memory LRU in front of an optional SQLite tier, with request coalescing:
+    concurrent misses for the same key share a single factory call."""
+
+    def __init__(self, name, maxsize, ttl, db_path=None):
+        self.name = name
+        self.ttl = ttl
+        self.memory = TTLCache(maxsize, ttl)
+        self.disk = SqliteCache(db_path, name) if db_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight = {}
+
+    async def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.disk:
+            value, remaining = await self.disk.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.set(key, value, remaining)
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.memory.set(key, value, ttl)
+        if self.disk:
+            await self.disk.set(key, value, ttl)
+
+    async def get_or_set(self, key, factory, should_store=None, ttl_for=None):
+        """Return the cached value or await factory() once for all concurrent
+        callers. should_store(value) can veto caching; ttl_for(value) can pick a
+        per-entry TTL, e.g. a shorter one for negative results."""
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(self._fill(key, factory, should_store, ttl_for))
+            entry = self._inflight[key] = [task, 0]
+        else:
+            self.coalesced += 1
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            # Last waiter gone (e.g. client disconnected): nobody needs the result
+            if entry[1] == 0 and not task.done():
+                task.cancel()
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+
+    async def _fill(self, key, factory, should_store, ttl_for):
+        try:
+            value = await factory()
+            if should_store is None or should_store(value):
+                await self.set(key, value, ttl_for(value) if ttl_for else None)
+            return value
+        finally:
+            if self._inflight.get(key, [None])[0] is asyncio.current_task():
+                del self._inflight[key]
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self.memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+        }
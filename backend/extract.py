@@ -0,0 +1,266 @@
+import re
+from collections import deque
+from dataclasses import dataclass
+
+DEFAULTS = {
+    "music": "BTS",
+    "movie": "Spirited Away",
+    "fashion": "Uniqlo",
+    "destination": "Tokyo",
+    "days": 2,
+}
+
+# How much each field contributes to the confidence score
+FIELD_WEIGHTS = {"destination": 0.3, "music": 0.2, "movie": 0.2, "fashion": 0.2, "days": 0.1}
+
+# Entities learned at runtime (e.g. from Qloo search results) stop being added past this
+MAX_LEARNED_ENTITIES = 50000
+
+WORD_NUMBERS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11,
+    "twelve": 12, "thirteen": 13, "fourteen": 14,
+}
+_NUMBER = r"\b(\d{1,2}|" + "|".join(WORD_NUMBERS) + r")"
+DAYS_RE = re.compile(_NUMBER + r"[\s-]*(?:full[\s-]+)?(day|days|night|nights)\b", re.I)
+WEEKS_RE = re.compile(_NUMBER + r"[\s-]*weeks?\b", re.I)
+WEEKEND_RE = re.compile(r"\b(?:long\s+)?weekend\b", re.I)
+# A city right after one of these is the destination rather than e.g. a home town
+DESTINATION_CUE_RE = re.compile(r"\b(?:in|to|visit|visiting|around|explore|exploring|at)\s+$", re.I)
+
+CITIES = {
+    "Tokyo": [], "Kyoto": [], "Osaka": [], "Seoul": [], "Busan": [], "Beijing": [],
+    "Shanghai": [], "Hong Kong": [], "Taipei": [], "Bangkok": [], "Singapore": [],
+    "Kuala Lumpur": ["KL"], "Hanoi": [], "Ho Chi Minh City": ["Saigon"], "Bali": [],
+    "Jakarta": [], "Manila": [], "Mumbai": ["Bombay"], "Delhi": ["New Delhi"],
+    "Bangalore": ["Bengaluru"], "Chennai": [], "Dubai": [], "Istanbul": [],
+    "Paris": [], "London": [], "Berlin": [], "Amsterdam": [], "Barcelona": [],
+    "Madrid": [], "Lisbon": [], "Rome": [], "Milan": [], "Florence": [], "Venice": [],
+    "Vienna": [], "Prague": [], "Budapest": [], "Copenhagen": [], "Stockholm": [],
+    "Oslo": [], "Helsinki": [], "Reykjavik": [], "Dublin": [], "Edinburgh": [],
+    "Manchester": [], "Brussels": [], "Zurich": [], "Athens": [], "Cairo": [],
+    "Marrakech": [], "Cape Town": [], "Nairobi": [], "Lagos": [],
+    "New York": ["NYC", "New York City"], "Los Angeles": [], "San Francisco": [],
+    "Chicago": [], "Seattle": [], "Austin": [], "Nashville": [], "New Orleans": [],
+    "Miami": [], "Las Vegas": [], "Boston": [], "Toronto": [], "Vancouver": [],
+    "Montreal": [], "Mexico City": ["CDMX"], "Havana": [], "Rio de Janeiro": ["Rio"],
+    "Sao Paulo": ["São Paulo"], "Buenos Aires": [], "Lima": [], "Bogota": ["Bogotá"],
+    "Sydney": [], "Melbourne": [], "Auckland": [],
+}
+
+# Curated seed dictionary; aliases resolve to the canonical name in the value
+ENTITIES = {
+    "music": {
+        "BTS": ["Bangtan Boys"], "BLACKPINK": [], "TWICE": [], "Stray Kids": [],
+        "NewJeans": [], "SEVENTEEN": [], "EXO": [], "Taylor Swift": [],
+        "Beyoncé": ["Beyonce"], "Drake": [], "The Weeknd": [], "Billie Eilish": [],
+        "Ed Sheeran": [], "Adele": [], "Bad Bunny": [], "Daft Punk": [],
+        "The Beatles": ["Beatles"], "Radiohead": [], "Coldplay": [],
+        "Arctic Monkeys": [], "Kendrick Lamar": [], "Frank Ocean": [],
+        "Joe Hisaishi": [], "Hikaru Utada": [], "YOASOBI": [], "Kenshi Yonezu": [],
+        "Ryuichi Sakamoto": [], "Miles Davis": [], "John Coltrane": [],
+        "Dua Lipa": [], "Rosalía": ["Rosalia"], "Burna Boy": [], "Wizkid": [],
+        "A. R. Rahman": ["AR Rahman", "A.R. Rahman"], "Ilaiyaraaja": [],
+    },
+    "movie": {
+        "Spirited Away": [], "My Neighbor Totoro": ["Totoro"],
+        "Howl's Moving Castle": [], "Princess Mononoke": [], "Kiki's Delivery Service": [],
+        "Your Name": [], "Akira": [], "Lost in Translation": [], "Amélie": ["Amelie"],
+        "Midnight in Paris": [], "Before Sunrise": [], "Roman Holiday": [],
+        "La La Land": [], "Parasite": [], "Oldboy": [], "In the Mood for Love": [],
+        "Chungking Express": [], "Crouching Tiger, Hidden Dragon": ["Crouching Tiger"],
+        "Blade Runner": [], "Star Wars": [], "Harry Potter": [],
+        "The Lord of the Rings": ["Lord of the Rings"], "Notting Hill": [],
+        "The Grand Budapest Hotel": ["Grand Budapest Hotel"], "Call Me by Your Name": [],
+        "Roma": [], "Coco": [], "City of God": [], "Slumdog Millionaire": [],
+        "Inception": [], "Interstellar": [], "Pulp Fiction": [], "The Godfather": [],
+        "Mamma Mia!": ["Mamma Mia"], "Eat Pray Love": [], "Kill Bill": [],
+    },
+    "fashion": {
+        "Uniqlo": [], "Muji": [], "COS": [], "Zara": [], "H&M": [], "Gucci": [],
+        "Prada": [], "Louis Vuitton": [], "Chanel": [], "Dior": [], "Balenciaga": [],
+        "Comme des Garçons": ["Comme des Garcons", "CDG"], "Issey Miyake": [],
+        "Yohji Yamamoto": [], "BAPE": ["A Bathing Ape"], "Supreme": [], "Off-White": [],
+        "Nike": [], "Adidas": [], "Levi's": ["Levis"], "Acne Studios": [],
+        "Arket": [], "Everlane": [], "Patagonia": [], "Stüssy": ["Stussy"],
+        "Gentle Monster": [], "Ader Error": [], "Sacai": [], "Kenzo": [], "Hermès": ["Hermes"],
+    },
+}
+
+# Genre words map to the same concrete picks the Gemini prompt asks for, at half weight
+GENRE_HINTS = {
+    "music": {"k-pop": "BTS", "kpop": "BTS", "j-pop": "YOASOBI", "jazz": "Miles Davis"},
+    "movie": {"studio ghibli": "Spirited Away", "ghibli": "Spirited Away", "anime": "Your Name"},
+    "fashion": {
+        "minimalist": "Uniqlo", "minimal": "Uniqlo", "streetwear": "BAPE",
+        "luxury": "Gucci", "vintage": "Levi's",
+    },
+}
+
+_ENTITY_KINDS = {
+    "urn:entity:artist": "music",
+    "urn:entity:movie": "movie",
+    "urn:entity:brand": "fashion",
+}
+
+
+class AhoCorasick:
+    """Multi-pattern matcher: one pass over the text finds every pattern"""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pattern, payload in patterns:
+            self._insert(pattern, payload)
+        self._link()
+
+    def _insert(self, pattern, payload):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(pattern), payload))
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def search(self, text):
+        """Yields (start, end, payload) for every occurrence"""
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, payload in self._out[node]:
+                yield i - length + 1, i + 1, payload
+
+
+@dataclass
+class Extraction:
+    music: str = None
+    movie: str = None
+    fashion: str = None
+    destination: str = None
+    days: int = None
+    confidence: float = 0.0
+
+    def as_tuple(self):
+        """Same shape as parse_user_input, with the usual defaults for gaps"""
+        return (
+            self.music or DEFAULTS["music"],
+            self.movie or DEFAULTS["movie"],
+            self.fashion or DEFAULTS["fashion"],
+            self.destination or DEFAULTS["destination"],
+            self.days or DEFAULTS["days"],
+        )
+
+
+class FastExtractor:
+    """Regexes for the trip length plus a single Aho-Corasick pass over a
+    gazetteer of cities and a seedable artist/movie/brand dictionary"""
+
+    def __init__(self):
+        # normalised pattern -> (kind, canonical value, weight)
+        self._patterns = {}
+        self._learned = 0
+        self._automaton = None
+        for city, aliases in CITIES.items():
+            for name in [city] + aliases:
+                self._add(name, "destination", city, 1.0)
+        for kind, names in ENTITIES.items():
+            for name, aliases in names.items():
+                for alias in [name] + aliases:
+                    self._add(alias, kind, name, 1.0)
+        for kind, hints in GENRE_HINTS.items():
+            for hint, value in hints.items():
+                self._add(hint, kind, value, 0.5)
+
+    def _add(self, name, kind, value, weight):
+        key = name.lower().strip()
+        if key and key not in self._patterns:
+            self._patterns[key] = (kind, value, weight)
+            self._automaton = None
+
+    def learn(self, name, entity_type, canonical=None):
+        """Seed a name resolved elsewhere (Qloo search) so later prompts skip the LLM"""
+        kind = _ENTITY_KINDS.get(entity_type)
+        # Very short titles ("Up", "Her") would match ordinary words
+        if not kind or not name or len(name.strip()) < 4 or self._learned >= MAX_LEARNED_ENTITIES:
+            return
+        if name.lower().strip() not in self._patterns:
+            self._learned += 1
+            self._add(name, kind, canonical or name, 1.0)
+
+    def _matches(self, text):
+        if self._automaton is None:
+            self._automaton = AhoCorasick(self._patterns.items())
+        matches = []
+        for start, end, payload in self._automaton.search(text):
+            if start > 0 and text[start - 1].isalnum():
+                continue
+            if end < len(text) and text[end].isalnum():
+                continue
+            matches.append((start, end, payload))
+        # Longest match wins where patterns overlap ("New York City" over "New York")
+        matches.sort(key=lambda m: (m[0], m[0] - m[1]))
+        kept, last_end = [], -1
+        for match in matches:
+            if match[0] >= last_end:
+                kept.append(match)
+                last_end = match[1]
+        return kept
+
+    def extract(self, user_input):
+        text = user_input.lower()
+        result = Extraction()
+        weights = {}
+
+        cities = []
+        for start, _, (kind, value, weight) in self._matches(text):
+            if kind == "destination":
+                cities.append((bool(DESTINATION_CUE_RE.search(text[max(0, start - 12):start])), value))
+            elif weights.get(kind, 0) < weight:
+                setattr(result, kind, value)
+                weights[kind] = weight
+        if cities:
+            cued = [city for has_cue, city in cities if has_cue]
+            result.destination = cued[0] if cued else cities[0][1]
+            weights["destination"] = 1.0
+
+        days = DAYS_RE.search(text)
+        weeks = WEEKS_RE.search(text)
+        if days:
+            result.days = _to_int(days.group(1))
+        elif weeks:
+            result.days = _to_int(weeks.group(1)) * 7
+        elif WEEKEND_RE.search(text):
+            result.days = 2
+        if result.days:
+            result.days = max(1, result.days)
+            weights["days"] = 1.0
+
+        result.confidence = round(sum(FIELD_WEIGHTS[k] * w for k, w in weights.items()), 3)
+        return result
+
+
+def _to_int(token):
+    return int(token) if token.isdigit() else WORD_NUMBERS[token.lower()]
+
+
+extractor = FastExtractor()
@@ -0,0 +1,158 @@
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+
+import aiohttp
+
+from cache import SqliteCache, TTLCache
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+jobs_total = registry.counter("bluvoyage_jobs_total", "Itinerary jobs by outcome (queued, rejected, succeeded, failed)")
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the queue, or this user's share of it, is full"""
+
+
+class MemoryJobStore:
+    def __init__(self, maxsize, ttl):
+        self.ttl = ttl
+        self._jobs = TTLCache(maxsize, ttl)
+
+    async def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    async def save(self, job):
+        self._jobs.set(job["id"], job, self.ttl)
+
+
+class SqliteJobStore:
+    """Job records in the shared cache file, so results outlive a restart"""
+
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self._db = SqliteCache(path, "jobs")
+
+    async def get(self, job_id):
+        job, _ = await self._db.get(job_id)
+        return job
+
+    async def save(self, job):
+        await self._db.set(job["id"], job, self.ttl)
+
+
+class JobQueue:
+    """Bounded worker pool over a priority queue. Within a priority, a user's
+    n-th queued job sorts after every other user's (n-1)-th, so one client
+    submitting a burst can't starve the rest."""
+
+    def __init__(self, run_job, store, workers=4, max_queued=100, max_per_user=5, webhook_timeout=10):
+        self.run_job = run_job
+        self.store = store
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_per_user = max_per_user
+        self.webhook_timeout = webhook_timeout
+        self._queue = asyncio.PriorityQueue()
+        self._queued_per_user = {}
+        self._seq = itertools.count()
+        self._tasks = []
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, user_input, user_id, priority=0, callback_url=None):
+        queued = self._queued_per_user.get(user_id, 0)
+        if len(self) >= self.max_queued or queued >= self.max_per_user:
+            jobs_total.inc(outcome="rejected")
+            raise QueueFull()
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "user_input": user_input,
+            "user_id": user_id,
+            "priority": priority,
+            "callback_url": callback_url,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "travel_plan": None,
+            "days": [],
+            "result": None,
+            "error": None,
+        }
+        await self.store.save(job)
+        self._queued_per_user[user_id] = queued + 1
+        # Higher priority runs first
+        self._queue.put_nowait((-priority, queued, next(self._seq), job))
+        jobs_total.inc(outcome="queued")
+        return job
+
+    async def _worker(self):
+        while True:
+            *_, job = await self._queue.get()
+            user_id = job["user_id"]
+            self._queued_per_user[user_id] -= 1
+            if not self._queued_per_user[user_id]:
+                del self._queued_per_user[user_id]
+            try:
+                await self._process(job)
+            except Exception as e:
+                logger.exception("Job %s crashed", job["id"])
+                job.update(status="failed", error=str(e), finished_at=time.time())
+                await self.store.save(job)
+                jobs_total.inc(outcome="failed")
+            finally:
+                self._queue.task_done()
+            if job["callback_url"]:
+                await self._notify(job)
+
+    async def _process(self, job):
+        job.update(status="running", started_at=time.time())
+        await self.store.save(job)
+        async for event in self.run_job(job["user_input"]):
+            if event["type"] == "plan":
+                job["travel_plan"] = event["travel_plan"]
+            elif event["type"] == "day":
+                job["days"].append(event["day"])
+            elif event["type"] == "done":
+                job["result"] = {"status": "success", "travel_plan": {**job["travel_plan"], "days": job["days"]}}
+                job.update(status="succeeded", finished_at=time.time())
+            elif event["type"] == "error":
+                job.update(status="failed", error=event["error"], finished_at=time.time())
+            # Partial days are visible to pollers while the rest are generated
+            await self.store.save(job)
+        if job["status"] == "running":
+            job.update(status="failed", error="Generation ended without a result", finished_at=time.time())
+            await self.store.save(job)
+        jobs_total.inc(outcome=job["status"])
+
+    async def _notify(self, job):
+        """POST the finished job to its callback URL; delivery is best effort"""
+        try:
+            timeout = aiohttp.ClientTimeout(total=self.webhook_timeout)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.post(job["callback_url"], json=public_view(job)) as response:
+                    if response.status >= 400:
+                        logger.warning("Webhook for job %s got HTTP %s", job["id"], response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Webhook for job %s failed: %r", job["id"], e)
+
+
+def public_view(job):
+    """Job record as returned to clients, without routing details"""
+    return {k: v for k, v in job.items() if k not in ("user_id", "callback_url")}
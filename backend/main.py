@@ -1,14 +1,72 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from planner import generate_itinerary_response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
+from typing import Optional
+from planner import (
+    generate_itinerary_response,
+    stream_itinerary_events,
+    cache_stats,
+    get_qloo_session,
+    close_qloo_session,
+    load_venue_index,
+    CACHE_DB_PATH,
+)
+from jobs import JobQueue, MemoryJobStore, SqliteJobStore, QueueFull, public_view
+from timing import RequestTimings, current_timings
+from metrics import registry, request_seconds
 import uvicorn
+import asyncio
+import json
+import logging
 import os
 import time
 
+# Upstream errors and fallbacks log at WARNING/INFO; DEBUG adds per-response detail
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "WARNING").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", 0.5))
+# Per-stage durations (parse, qloo, generate, ...) in a Server-Timing header
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+# Job mode: concurrent generations, and how many jobs may wait in total and per user
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", 100))
+JOB_MAX_PER_USER = int(os.getenv("JOB_MAX_PER_USER", 5))
+JOB_TTL = float(os.getenv("JOB_TTL", 24 * 3600))
+JOB_STORE_SIZE = int(os.getenv("JOB_STORE_SIZE", 10000))
+# "memory", or "sqlite" to keep job records in JOB_DB_PATH (defaults to CACHE_DB_PATH)
+JOB_STORE = os.getenv("JOB_STORE", "memory")
+JOB_DB_PATH = os.getenv("JOB_DB_PATH") or CACHE_DB_PATH or "jobs.sqlite3"
+JOB_RETRY_AFTER = int(os.getenv("JOB_RETRY_AFTER", 10))
+
+if JOB_STORE == "sqlite":
+    job_store = SqliteJobStore(JOB_DB_PATH, JOB_TTL)
+else:
+    job_store = MemoryJobStore(JOB_STORE_SIZE, JOB_TTL)
+job_queue = JobQueue(
+    stream_itinerary_events, job_store,
+    workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, max_per_user=JOB_MAX_PER_USER,
+)
+registry.callback("bluvoyage_jobs_queued", "Itinerary jobs waiting for a worker", "gauge",
+                  lambda: [({}, len(job_queue))])
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_qloo_session()
+    await load_venue_index()
+    job_queue.start()
+    yield
+    await job_queue.stop()
+    await close_qloo_session()
+
 app = FastAPI(
     title="Cultural Travel Planner API",
-    version="2.0"
+    version="2.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -21,18 +79,92 @@ app.add_middleware(
 
 @app.middleware("http")
 async def add_timing_header(request: Request, call_next):
+    timings = RequestTimings()
+    current_timings.set(timings)
     start = time.time()
     response = await call_next(request)
     duration = round(time.time() - start, 3)
+    # Route templates rather than raw paths keep label cardinality bounded
+    route = request.scope.get("route")
+    request_seconds.observe(
+        time.time() - start,
+        path=getattr(route, "path", "unmatched"),
+        status=str(response.status_code),
+    )
     response.headers["X-Process-Time"] = str(duration)
+    if SERVER_TIMING and timings.spans:
+        response.headers["Server-Timing"] = timings.server_timing()
     return response
 
+async def run_until_disconnect(request: Request, coro):
+    """Await coro, cancelling it if the client goes away before it finishes"""
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                # 499: client closed request (nginx convention), never actually delivered
+                return Response(status_code=499)
+    finally:
+        task.cancel()
+
 class ItineraryRequest(BaseModel):
     user_input: str
 
 @app.post("/generate-itinerary")
-async def generate_itinerary(request: ItineraryRequest):
-    return await generate_itinerary_response(request.user_input)
+async def generate_itinerary(body: ItineraryRequest, request: Request):
+    return await run_until_disconnect(request, generate_itinerary_response(body.user_input))
+
+@app.post("/generate-itinerary/stream")
+async def generate_itinerary_stream(body: ItineraryRequest):
+    """NDJSON stream: one "plan" event, one "day" event per finished day,
+    then "done" (or "error"). Starlette cancels the generator on disconnect."""
+    async def events():
+        async for event in stream_itinerary_events(body.user_input):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+class JobRequest(BaseModel):
+    user_input: str
+    user_id: Optional[str] = None
+    priority: int = Field(0, ge=0, le=9)
+    callback_url: Optional[str] = None
+
+@app.post("/itineraries", status_code=202)
+async def submit_itinerary_job(body: JobRequest, request: Request):
+    """Queue an itinerary and return its job id at once. Poll GET
+    /itineraries/{id} for status and partial days, or pass callback_url to
+    have the finished job POSTed back."""
+    user_id = body.user_id or request.headers.get("x-user-id") or (request.client.host if request.client else "anonymous")
+    try:
+        job = await job_queue.submit(body.user_input, user_id, body.priority, body.callback_url)
+    except QueueFull:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many queued itineraries, try again shortly",
+            headers={"Retry-After": str(JOB_RETRY_AFTER)},
+        )
+    return {"id": job["id"], "status": job["status"], "queued": len(job_queue)}
+
+@app.get("/itineraries/{job_id}")
+async def get_itinerary_job(job_id: str):
+    job = await job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return public_view(job)
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return cache_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text format: stage and request latency histograms, upstream
+    errors, fallbacks, parse paths, Gemini token usage and cache counters"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv("PORT", 10000)), reload=True)
@@ -1,36 +1,281 @@
 import os
-import json
+import logging
 import aiohttp
 import asyncio
-import re
 from dotenv import load_dotenv
-from functools import lru_cache
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from cache import TieredCache, make_key
+from extract import extractor
+from timing import Budget, span
+from metrics import registry, upstream_errors, fallbacks, parse_paths, llm_tokens
+from resilience import Upstream, UpstreamUnavailable, register_breaker_metrics
+from venues import VenueIndex, order_segment
+from schemas import (
+    DayPlan, ItineraryDocument, ParsedInput,
+    DAY_SCHEMA, ITINERARY_SCHEMA, PARSED_INPUT_SCHEMA,
+)
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 QLOO_API_KEY = os.getenv("QLOO_API_KEY")
+QLOO_BASE_URL = os.getenv("QLOO_BASE_URL", "https://hackathon.api.qloo.com").rstrip("/")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 32))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", 60))
+ITINERARY_CACHE_SIZE = int(os.getenv("ITINERARY_CACHE_SIZE", 512))
+ITINERARY_CACHE_TTL = float(os.getenv("ITINERARY_CACHE_TTL", 6 * 3600))
+# Optional SQLite file shared by the on-disk cache tiers; unset keeps caches in memory only
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH") or None
+QLOO_TIMEOUT = float(os.getenv("QLOO_TIMEOUT", 10))
+QLOO_MAX_CONNECTIONS = int(os.getenv("QLOO_MAX_CONNECTIONS", 100))
+QLOO_MAX_CONNECTIONS_PER_HOST = int(os.getenv("QLOO_MAX_CONNECTIONS_PER_HOST", 32))
+QLOO_CACHE_SIZE = int(os.getenv("QLOO_CACHE_SIZE", 4096))
+QLOO_CACHE_TTL = float(os.getenv("QLOO_CACHE_TTL", 24 * 3600))
+# Misses (and failed lookups) are remembered briefly so they don't hammer Qloo
+QLOO_NEGATIVE_TTL = float(os.getenv("QLOO_NEGATIVE_TTL", 600))
+# Prompts the local extractor scores at or above this skip the Gemini parse
+FAST_PARSE_MIN_CONFIDENCE = float(os.getenv("FAST_PARSE_MIN_CONFIDENCE", 0.9))
+# End-to-end deadline shared by parse, Qloo and generation for one request
+REQUEST_BUDGET = float(os.getenv("REQUEST_BUDGET", 90))
+# Trips at least this long are generated one day per Gemini call, concurrently (0 disables)
+PER_DAY_MIN_DAYS = int(os.getenv("PER_DAY_MIN_DAYS", 4))
+PER_DAY_CONCURRENCY = int(os.getenv("PER_DAY_CONCURRENCY", 7))
+PER_DAY_RETRIES = int(os.getenv("PER_DAY_RETRIES", 1))
+# Total budget for all Qloo lookups of a request before falling back to tags/names
+QLOO_DEADLINE = float(os.getenv("QLOO_DEADLINE", 4))
+# Provider quotas for the token buckets (0 disables a limit), and how long a
+# call may wait for a token before it is shed
+QLOO_RATE = float(os.getenv("QLOO_RATE", 20))
+QLOO_BURST = int(os.getenv("QLOO_BURST", 40))
+QLOO_RATE_MAX_WAIT = float(os.getenv("QLOO_RATE_MAX_WAIT", 0.5))
+QLOO_RETRIES = int(os.getenv("QLOO_RETRIES", 2))
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", 1000))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", 50))
+GEMINI_RATE_MAX_WAIT = float(os.getenv("GEMINI_RATE_MAX_WAIT", 5))
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", 2))
+# Consecutive failures that open an endpoint's breaker, and seconds before it is retried
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", 30))
+
+# Offline venue index (python -m venues build) used to ground prompts and enrichment
+VENUE_DB_PATH = os.getenv("VENUE_DB_PATH") or None
+# Known venues per category listed in generation prompts (0 leaves prompts ungrounded)
+VENUE_PROMPT_LIMIT = int(os.getenv("VENUE_PROMPT_LIMIT", 4))
+
+GEMINI_MODEL = "gemini-2.5-flash-lite"
 genai.configure(api_key=GOOGLE_API_KEY)
-model = genai.GenerativeModel("gemini-2.5-flash-lite")
+model = genai.GenerativeModel(GEMINI_MODEL)
+
+# JSON mode with a response schema: no markdown fences, no prose, and far
+# fewer output tokens than echoing a worked example
+PARSE_CONFIG = genai.types.GenerationConfig(
+    temperature=0.3,
+    max_output_tokens=256,
+    response_mime_type="application/json",
+    response_schema=PARSED_INPUT_SCHEMA,
+)
+ITINERARY_CONFIG = genai.types.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=ITINERARY_SCHEMA,
+)
+DAY_CONFIG = genai.types.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=DAY_SCHEMA,
+)
+
+class QlooStatusError(Exception):
+    def __init__(self, status, body):
+        super().__init__(f"HTTP {status}: {body[:200]}")
+        self.status = status
+
+def qloo_retryable(exc):
+    if isinstance(exc, QlooStatusError):
+        return exc.status == 429 or exc.status >= 500
+    return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError))
+
+GEMINI_RETRYABLE = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.InternalServerError,
+    google_exceptions.DeadlineExceeded,
+    asyncio.TimeoutError,
+)
+
+qloo = Upstream(
+    "qloo", QLOO_RATE, QLOO_BURST, max_wait=QLOO_RATE_MAX_WAIT, retries=QLOO_RETRIES,
+    failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET, is_retryable=qloo_retryable,
+)
+gemini = Upstream(
+    "gemini", GEMINI_RPM / 60, GEMINI_BURST, max_wait=GEMINI_RATE_MAX_WAIT, retries=GEMINI_RETRIES,
+    backoff=0.5, max_backoff=8, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET,
+    is_retryable=lambda exc: isinstance(exc, GEMINI_RETRYABLE),
+)
+register_breaker_metrics(qloo, gemini)
+
+itinerary_cache = TieredCache("itinerary", ITINERARY_CACHE_SIZE, ITINERARY_CACHE_TTL, CACHE_DB_PATH)
+entity_cache = TieredCache("qloo_entities", QLOO_CACHE_SIZE, QLOO_CACHE_TTL, CACHE_DB_PATH)
+recs_cache = TieredCache("qloo_recommendations", QLOO_CACHE_SIZE, QLOO_CACHE_TTL, CACHE_DB_PATH)
 
-async def fetch(session, method, url, **kwargs):
+_qloo_session = None
+_venue_index = VenueIndex()
+
+QLOO_DOMAIN_VARIANTS = {
+    "music": ["music", "artists", "artist"],
+    "movies": ["movies", "films", "film"],
+    "fashion": ["fashion", "brands", "brand"]
+}
+# recommendations/<variant> path that last answered for each domain
+_domain_variants = {}
+
+TASTE_LOOKUPS = [
+    # (key in recs, Qloo entity type, recommendation domain)
+    ("music", "urn:entity:artist", "music"),
+    ("movie", "urn:entity:movie", "movies"),
+    ("fashion", "urn:entity:brand", "fashion"),
+]
+
+def normalize(text):
+    return " ".join(str(text).casefold().split())
+
+# Caps in-flight Gemini calls per worker so a burst can't exhaust the quota
+_gemini_slots = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+def record_gemini_error(error):
+    reason = "timeout" if isinstance(error, asyncio.TimeoutError) else type(error).__name__
+    upstream_errors.inc(service="gemini", reason=reason)
+
+def record_token_usage(response, kind):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    llm_tokens.inc(getattr(usage, "prompt_token_count", 0) or 0, kind=kind, direction="prompt")
+    llm_tokens.inc(getattr(usage, "candidates_token_count", 0) or 0, kind=kind, direction="output")
+
+async def generate_content(prompt, timeout=GEMINI_TIMEOUT, kind="generate", **kwargs):
+    """Run a Gemini call on the event loop without blocking it. Raises
+    UpstreamUnavailable without calling Gemini when the call is shed."""
+    async with _gemini_slots:
+        try:
+            response = await gemini.call(
+                GEMINI_MODEL, lambda: model.generate_content_async(prompt, **kwargs), timeout
+            )
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            record_gemini_error(e)
+            raise
+    record_token_usage(response, kind)
+    return response
+
+async def stream_content(prompt, timeout=GEMINI_TIMEOUT, kind="stream", **kwargs):
+    """Yield the text of a streamed Gemini call as it arrives, within a total timeout"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    async with _gemini_slots:
+        try:
+            # Only opening the stream is retried; a failure mid-stream ends it
+            response = await gemini.call(
+                GEMINI_MODEL, lambda: model.generate_content_async(prompt, stream=True, **kwargs), timeout
+            )
+            chunks = response.__aiter__()
+            chunk = None
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), deadline - loop.time())
+                except StopAsyncIteration:
+                    break
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks carrying only a finish reason have no text
+                    continue
+                yield text
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            record_gemini_error(e)
+            raise
+    # The final chunk carries the usage totals for the whole stream
+    record_token_usage(chunk, kind)
+
+def get_qloo_session():
+    """App-lifetime pooled session so requests reuse keep-alive connections to Qloo"""
+    global _qloo_session
+    if _qloo_session is None or _qloo_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=QLOO_MAX_CONNECTIONS,
+            limit_per_host=QLOO_MAX_CONNECTIONS_PER_HOST,
+            keepalive_timeout=60,
+            ttl_dns_cache=300,
+        )
+        _qloo_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=QLOO_TIMEOUT),
+        )
+    return _qloo_session
+
+async def load_venue_index():
+    """Load VENUE_DB_PATH, if set, off the event loop; call once at startup"""
+    global _venue_index
+    if VENUE_DB_PATH:
+        _venue_index = await asyncio.to_thread(VenueIndex.load, VENUE_DB_PATH)
+        logger.info("Loaded %d venues from %s", len(_venue_index), VENUE_DB_PATH)
+
+async def close_qloo_session():
+    global _qloo_session
+    if _qloo_session is not None:
+        await _qloo_session.close()
+        _qloo_session = None
+
+QLOO_DOMAIN_VARIANTS = {
+    "music": ["music", "artists", "artist"],
+    "movies": ["movies", "films", "film"],
+    "fashion": ["fashion", "brands", "brand"]
+}
+# recommendations/<variant> path that last answered for each domain
+_domain_variants = {}
+
+TASTE_LOOKUPS = [
+    # (key in recs, Qloo entity type, recommendation domain)
+    ("music", "urn:entity:artist", "music"),
+    ("movie", "urn:entity:movie", "movies"),
+    ("fashion", "urn:entity:brand", "fashion"),
+]
+
+async def fetch(session, method, url, endpoint, **kwargs):
+    """Call Qloo through the shared rate limit, retries and endpoint breaker.
+    Failures return {}; a shed call raises UpstreamUnavailable instead so the
+    caches don't remember an outage as a miss."""
     # Filter out None values from params to prevent aiohttp errors
     if 'params' in kwargs and kwargs['params']:
         kwargs['params'] = {k: v for k, v in kwargs['params'].items() if v is not None}
-    
-    async with session.request(method, url, **kwargs) as response:
-        if response.status != 200:
-            print(f"API Error {response.status}: {await response.text()}")
-            return {}
-        return await response.json()
+
+    async def attempt():
+        async with session.request(method, url, **kwargs) as response:
+            if response.status != 200:
+                raise QlooStatusError(response.status, await response.text())
+            return await response.json()
+
+    try:
+        return await qloo.call(endpoint, attempt)
+    except QlooStatusError as e:
+        upstream_errors.inc(service="qloo", reason=f"http_{e.status}")
+        logger.warning("Qloo error on %s %s: %s", method, url, e)
+        return {}
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        upstream_errors.inc(service="qloo", reason="timeout" if isinstance(e, asyncio.TimeoutError) else type(e).__name__)
+        logger.warning("Qloo error on %s %s: %r", method, url, e)
+        return {}
 
 async def get_entity_id(session, name, entity_type):
-    url = "https://hackathon.api.qloo.com/search"
+    url = f"{QLOO_BASE_URL}/search"
     headers = {"x-api-key": QLOO_API_KEY}
     params = {"query": name, "types": entity_type}
-    data = await fetch(session, "GET", url, headers=headers, params=params)
+    data = await fetch(session, "GET", url, "search", headers=headers, params=params)
     
     results = data.get("results", [])
     if results:
@@ -42,32 +287,73 @@ async def get_entity_id(session, name, entity_type):
 async def get_recommendations(session, entity_id, domain):
     if not entity_id:
         return ["No recommendations found"]
-    
-    domain_mappings = {
-        "music": ["music", "artists", "artist"],
-        "movies": ["movies", "films", "film"], 
-        "fashion": ["fashion", "brands", "brand"]
-    }
-    
-    for domain_variant in domain_mappings.get(domain, [domain]):
-        url = f"https://hackathon.api.qloo.com/recommendations/{domain_variant}"
-        headers = {"x-api-key": QLOO_API_KEY, "Content-Type": "application/json"}
-        payload = {"ids": [entity_id], "count": 5}
-        data = await fetch(session, "POST", url, headers=headers, json=payload)
-        
-        recommendations = data.get("recommendations", [])
-        if recommendations:
-            rec_names = [r.get("name", "Unknown") for r in recommendations if r.get("name")]
-            return rec_names
-    
-    return [f"No {domain} recommendations found"]
+
+    rec_names = await cached_recommendations(session, entity_id, domain)
+    return rec_names or [f"No {domain} recommendations found"]
+
+async def cached_recommendations(session, entity_id, domain):
+    """Recommendation names for an entity, [] when Qloo has none"""
+    return await recs_cache.get_or_set(
+        make_key(entity_id, domain),
+        lambda: fetch_recommendations(session, entity_id, domain),
+        ttl_for=lambda names: None if names else QLOO_NEGATIVE_TTL,
+    )
+
+async def fetch_recommendation_variant(session, entity_id, domain_variant):
+    url = f"{QLOO_BASE_URL}/recommendations/{domain_variant}"
+    headers = {"x-api-key": QLOO_API_KEY, "Content-Type": "application/json"}
+    payload = {"ids": [entity_id], "count": 5}
+    with span("qloo_recs"):
+        data = await fetch(session, "POST", url, "recommendations", headers=headers, json=payload)
+
+    recommendations = data.get("recommendations", [])
+    rec_names = [r.get("name", "Unknown") for r in recommendations if r.get("name")]
+    return domain_variant, rec_names
+
+async def fetch_recommendations(session, entity_id, domain):
+    # Once a variant has answered for a domain, stop probing the others
+    known = _domain_variants.get(domain)
+    if known:
+        _, rec_names = await fetch_recommendation_variant(session, entity_id, known)
+        return rec_names
+
+    # Otherwise race every variant and keep the first one that returns results
+    tasks = [
+        asyncio.create_task(fetch_recommendation_variant(session, entity_id, variant))
+        for variant in QLOO_DOMAIN_VARIANTS.get(domain, [domain])
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            variant, rec_names = await next_done
+            if rec_names:
+                _domain_variants[domain] = variant
+                return rec_names
+        return []
+    finally:
+        for task in tasks:
+            task.cancel()
 
 async def get_entity_with_fallback(session, name, entity_type):
     """Get entity and extract useful info even if recommendations fail"""
-    url = "https://hackathon.api.qloo.com/search"
+    entity = await entity_cache.get_or_set(
+        make_key(normalize(name), entity_type),
+        lambda: search_entity(session, name, entity_type),
+        ttl_for=lambda result: None if result[0] else QLOO_NEGATIVE_TTL,
+    )
+    entity_id, entity_name = entity[0], entity[1]
+    if entity_id:
+        # Resolved names feed the local extractor so future prompts can skip the LLM parse
+        extractor.learn(entity_name, entity_type)
+        extractor.learn(name, entity_type, canonical=entity_name)
+    # Lists after a round trip through the disk tier
+    return tuple(entity)
+
+async def search_entity(session, name, entity_type):
+    url = f"{QLOO_BASE_URL}/search"
     headers = {"x-api-key": QLOO_API_KEY}
     params = {"query": name, "types": entity_type}
-    data = await fetch(session, "GET", url, headers=headers, params=params)
+    with span("qloo_search"):
+        data = await fetch(session, "GET", url, "search", headers=headers, params=params)
     
     results = data.get("results", [])
     if results:
@@ -83,165 +369,169 @@ async def get_entity_with_fallback(session, name, entity_type):
                 if tag_name and tag_name not in related_entities:
                     related_entities.append(tag_name)
         
-        return entity_id, entity_name, related_entities
+        return [entity_id, entity_name, related_entities]
     
-    return None, name, []
-
-async def gather_preferences(music, movie, fashion):
-    async with aiohttp.ClientSession() as session:
-        music_data, movie_data, fashion_data = await asyncio.gather(
-            get_entity_with_fallback(session, music, "urn:entity:artist"),
-            get_entity_with_fallback(session, movie, "urn:entity:movie"),
-            get_entity_with_fallback(session, fashion, "urn:entity:brand"),
-        )
-        
-        music_recs = await get_recommendations(session, music_data[0], "music")
-        movie_recs = await get_recommendations(session, movie_data[0], "movies") 
-        fashion_recs = await get_recommendations(session, fashion_data[0], "fashion")
-        
-        if music_recs == ['No music recommendations found'] and music_data[2]:
-            music_recs = music_data[2][:3]
-            
-        if movie_recs == ['No movies recommendations found'] and movie_data[2]:
-            movie_recs = movie_data[2][:3]
-            
-        if fashion_recs == ['No fashion recommendations found'] and fashion_data[2]:
-            fashion_recs = fashion_data[2][:3]
-
-        if not music_recs or music_recs == ['No music recommendations found']:
-            music_recs = [music_data[1]]
-        if not movie_recs or movie_recs == ['No movies recommendations found']:
-            movie_recs = [movie_data[1]]
-        if not fashion_recs or fashion_recs == ['No fashion recommendations found']:
-            fashion_recs = [fashion_data[1]]
-
-        return {"music": music_recs, "movie": movie_recs, "fashion": fashion_recs}
-
-def parse_user_input(user_input):
+    return [None, name, []]
+
+async def resolve_taste(session, name, entity_type, domain, partial):
+    """Entity search then recommendations for one taste, recording progress in
+    partial so whatever finished can still be used if the deadline hits"""
+    entity = await get_entity_with_fallback(session, name, entity_type)
+    partial[domain] = (entity, [])
+    if entity[0]:
+        partial[domain] = (entity, await cached_recommendations(session, entity[0], domain))
+
+async def gather_preferences(music, movie, fashion, deadline=QLOO_DEADLINE):
+    session = get_qloo_session()
+    names = {"music": music, "movie": movie, "fashion": fashion}
+    partial = {}
+    tasks = [
+        asyncio.create_task(resolve_taste(session, names[key], entity_type, domain, partial))
+        for key, entity_type, domain in TASTE_LOOKUPS
+    ]
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+    finally:
+        for task in tasks:
+            task.cancel()
+    if pending:
+        fallbacks.inc(len(pending), kind="qloo_deadline")
+        logger.info("Qloo deadline of %gs hit, falling back for %d tastes", deadline, len(pending))
+    for task in done:
+        if isinstance(task.exception(), UpstreamUnavailable):
+            # Breaker open or over quota: cached lookups were used, the rest skipped
+            fallbacks.inc(kind="qloo_shed")
+        elif task.exception():
+            logger.warning("Qloo lookup failed: %r", task.exception())
+
+    recs = {}
+    for key, _, domain in TASTE_LOOKUPS:
+        (_, entity_name, related), rec_names = partial.get(domain, ((None, names[key], []), []))
+        # Fall back to the entity's genre/influence tags, then to the name itself
+        if not rec_names:
+            fallbacks.inc(kind="qloo_tags" if related else "qloo_name")
+        recs[key] = rec_names or related[:3] or [entity_name]
+    return recs
+
+async def prefetch_taste(session, name, entity_type, domain):
+    """Warm the Qloo caches for a guessed name; a later gather_preferences for
+    the same name joins these in-flight lookups instead of repeating them"""
+    await resolve_taste(session, name, entity_type, domain, {})
+
+async def plan_trip(user_input, budget):
+    """Parse the prompt and resolve its tastes on Qloo. When the Gemini parse is
+    needed, names the local extractor already spotted are looked up while it runs."""
+    with span("parse"):
+        fast = extractor.extract(user_input)
+    prefetches = []
+    if fast.confidence >= FAST_PARSE_MIN_CONFIDENCE:
+        parse_paths.inc(path="fast")
+        parsed = fast.as_tuple()
+    else:
+        parse_paths.inc(path="llm")
+        session = get_qloo_session()
+        guesses = {"music": fast.music, "movie": fast.movie, "fashion": fast.fashion}
+        prefetches = [
+            asyncio.create_task(prefetch_taste(session, guesses[key], entity_type, domain))
+            for key, entity_type, domain in TASTE_LOOKUPS
+            if guesses[key]
+        ]
+        with span("parse"):
+            parsed = await parse_with_llm(user_input, fast, timeout=budget.remaining(GEMINI_TIMEOUT))
+
+    music, movie, fashion, city, days = parsed
+    try:
+        with span("qloo"):
+            recs = await gather_preferences(music, movie, fashion, deadline=budget.remaining(QLOO_DEADLINE))
+    finally:
+        # Guesses the Gemini parse didn't confirm are no longer needed
+        for task in prefetches:
+            task.cancel()
+    return parsed, recs
+
+async def parse_user_input(user_input):
+    """Extract preferences and destination, locally when the fast extractor is
+    confident and with Gemini otherwise"""
+    fast = extractor.extract(user_input)
+    if fast.confidence >= FAST_PARSE_MIN_CONFIDENCE:
+        parse_paths.inc(path="fast")
+        return fast.as_tuple()
+    parse_paths.inc(path="llm")
+    return await parse_with_llm(user_input, fast)
+
+async def parse_with_llm(user_input, fast=None, timeout=GEMINI_TIMEOUT):
     """Extract preferences and destination from user input using AI"""
     prompt = f"""
-Analyze this user input and extract travel parameters in JSON format.
+Extract travel parameters from this user input.
 
 User input: "{user_input}"
 
-Extract:
-1. Music preference (artist, band, or genre) - be specific about artist names
-2. Movie/film preference (movie, director, genre, or franchise) - be specific about movie titles  
-3. Fashion/style preference (brand, style, or fashion category) - be specific about brand names
-4. Destination city
-5. Number of days for the trip
-
-Rules:
-- For K-pop, extract specific artist names like "BTS", "BLACKPINK", "TWICE" etc.
-- For Studio Ghibli, extract specific movie titles like "Spirited Away", "My Neighbor Totoro" etc.
-- For minimalist fashion, extract specific brands like "COS", "Uniqlo", "Muji" etc.
-- If destination isn't mentioned, use: "Tokyo"
-- If days aren't mentioned, use: 2
-- Return ONLY valid JSON in this exact format:
-{{
-  "music": "...",
-  "movie": "...",
-  "fashion": "...",
-  "destination": "...",
-  "days": 2
-}}
+- music: artist or band (be specific: for K-pop use e.g. "BTS", "BLACKPINK", "TWICE")
+- movie: film title (be specific: for Studio Ghibli use e.g. "Spirited Away", "My Neighbor Totoro")
+- fashion: brand (be specific: for minimalist fashion use e.g. "COS", "Uniqlo", "Muji")
+- destination: city, "Tokyo" if not mentioned
+- days: number of days, 2 if not mentioned
 """
     try:
-        response = model.generate_content(prompt, generation_config=genai.types.GenerationConfig(
-            temperature=0.3,
-            max_output_tokens=256
-        ))
-        text = response.text.strip()
-        
-        # Extract JSON from response
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0].strip()
-        elif "```" in text:
-            text = text.split("```")[1].strip()
-        
-        data = json.loads(text)
-        return (
-            data.get('music', 'BTS'),
-            data.get('movie', 'Spirited Away'), 
-            data.get('fashion', 'Uniqlo'),
-            data.get('destination', 'Tokyo'),
-            int(data.get('days', 2))
-        )
+        response = await generate_content(prompt, timeout=timeout, kind="parse", generation_config=PARSE_CONFIG)
+        data = ParsedInput.model_validate_json(response.text)
+        return data.music, data.movie, data.fashion, data.destination, data.days
     except Exception as e:
-        print(f"Input parsing failed: {e}")
-        return "BTS", "Spirited Away", "Uniqlo", "Tokyo", 2
+        fallbacks.inc(kind="parse_extractor")
+        logger.warning("Input parsing failed: %s", e)
+        # Whatever the local extractor found beats the hard-coded defaults
+        return (fast or extractor.extract(user_input)).as_tuple()
+
+ACTIVITY_RULES = """Each day has a creative theme and exactly 6 activities at 09:00, 11:30, 13:00, 14:30, 16:30 and 19:00.
+category is one of hidden_gem, film, dining, fashion, music; dining at 13:00 and 19:00.
+location is a real, specific venue name; cultural_connection says how it ties to the tastes."""
+
+def known_venues(city):
+    """Prompt lines listing indexed venues per category, so the model prefers
+    places enrichment can locate; empty when the city isn't indexed"""
+    city_venues = _venue_index.city(city)
+    if city_venues is None or VENUE_PROMPT_LIMIT <= 0:
+        return ""
+    lines = []
+    for category in CATEGORY_ICONS:
+        names = [v.name for v in city_venues.by_category(category, VENUE_PROMPT_LIMIT)]
+        if names:
+            lines.append(f"- {category}: {', '.join(names)}")
+    if not lines:
+        return ""
+    return f"\nKnown venues in {city} (prefer these where they fit):\n" + "\n".join(lines) + "\n"
 
 def build_prompt(user_input, recs, city="Tokyo", days=2):
     return f"""
 User said: "{user_input}"
-Plan a {days}-day cultural itinerary in {city}.
+Plan a {days}-day cultural itinerary in {city} (destination "{city}", duration {days}).
 
 Tastes:
 - Music: {', '.join(recs['music'])}
 - Film: {', '.join(recs['movie'])}
 - Fashion: {', '.join(recs['fashion'])}
+{known_venues(city)}
+{ACTIVITY_RULES}
+"""
 
-Create exactly 6 activities per day with specific times: 09:00, 11:30, 13:00, 14:30, 16:30, 19:00
-
-Output ONLY valid JSON in this exact format:
-{{
-  "itinerary": {{
-    "destination": "{city}",
-    "duration": {days},
-    "days": [
-      {{
-        "day": 1,
-        "theme": "Creative theme name",
-        "activities": [
-          {{
-            "time": "09:00",
-            "location": "Specific venue name",
-            "category": "hidden_gem",
-            "description": "Detailed description",
-            "cultural_connection": "How this connects to user preferences"
-          }},
-          {{
-            "time": "11:30",
-            "location": "Another venue name",
-            "category": "film",
-            "description": "Another description",
-            "cultural_connection": "Connection explanation"
-          }},
-          {{
-            "time": "13:00",
-            "location": "Restaurant name",
-            "category": "dining",
-            "description": "Dining description",
-            "cultural_connection": "Cultural connection"
-          }},
-          {{
-            "time": "14:30",
-            "location": "Fashion venue",
-            "category": "fashion",
-            "description": "Fashion activity",
-            "cultural_connection": "Fashion connection"
-          }},
-          {{
-            "time": "16:30",
-            "location": "Music venue",
-            "category": "music",
-            "description": "Music activity",
-            "cultural_connection": "Music connection"
-          }},
-          {{
-            "time": "19:00",
-            "location": "Evening venue",
-            "category": "dining",
-            "description": "Evening activity",
-            "cultural_connection": "Evening connection"
-          }}
-        ]
-      }}
-    ]
-  }}
-}}
+def build_day_prompt(user_input, recs, city, day, days, avoid=()):
+    """Prompt for a single day of a longer trip. Each day spotlights a different
+    recommendation per taste so parallel calls don't converge on the same venues."""
+    spotlight = {key: names[(day - 1) % len(names)] for key, names in recs.items() if names}
+    avoid_line = f"\nDo NOT use any of these venues, they are already on other days: {', '.join(avoid)}\n" if avoid else ""
+    return f"""
+User said: "{user_input}"
+This is day {day} of a {days}-day cultural itinerary in {city}. Plan ONLY day {day}.
+
+Tastes:
+- Music: {', '.join(recs['music'])}
+- Film: {', '.join(recs['movie'])}
+- Fashion: {', '.join(recs['fashion'])}
 
-CRITICAL: Every activity MUST have a time field with format "HH:MM". Use real venue names in {city}.
+Spotlight for day {day}: {spotlight.get('music', '')}, {spotlight.get('movie', '')}, {spotlight.get('fashion', '')}.
+Each day of the trip is planned separately, so choose venues in a different part of {city} than a typical day 1 and avoid the most obvious landmarks unless they fit the spotlight.
+{avoid_line}{known_venues(city)}
+{ACTIVITY_RULES}
 """
 
 def generate_maps_link(location, city):
@@ -249,86 +539,372 @@ def generate_maps_link(location, city):
     query = f"{location}, {city}".replace(" ", "+")
     return f"https://www.google.com/maps/search/{query}"
 
-async def generate_itinerary_response(user_input):
-    music, movie, fashion, city, days = parse_user_input(user_input)
-    recs = await gather_preferences(music, movie, fashion)
-    prompt = build_prompt(user_input, recs, city, days)
+def venue_maps_link(venue):
+    """Maps link pinned to an indexed venue's coordinates and place"""
+    link = f"https://www.google.com/maps/search/?api=1&query={venue.lat},{venue.lng}"
+    return f"{link}&query_place_id={venue.place_id}" if venue.place_id else link
+
+def itinerary_cache_key(music, movie, fashion, city, days, recs):
+    """Near-identical prompts parse to the same tuple, so they share a cache entry"""
+    return make_key(
+        [normalize(v) for v in (music, movie, fashion, city)],
+        int(days),
+        {domain: [normalize(r) for r in names] for domain, names in recs.items()},
+    )
 
-    response = model.generate_content(prompt)
-    streamed = "".join(part.text for part in response)
+def is_success(response):
+    return response.get("status") == "success"
 
-    json_match = re.search(r'\{[\s\S]*\}', streamed)
-    if json_match:
+def cache_stats():
+    return {
+        "itinerary": itinerary_cache.stats(),
+        "qloo_entities": entity_cache.stats(),
+        "qloo_recommendations": recs_cache.stats(),
+    }
+
+def cache_lookup_samples():
+    for name, stats in cache_stats().items():
+        for result in ("hits", "disk_hits", "misses", "coalesced"):
+            yield {"cache": name, "result": result}, stats[result]
+
+def cache_size_samples():
+    for name, stats in cache_stats().items():
+        yield {"cache": name}, stats["size"]
+
+registry.callback("bluvoyage_cache_lookups_total", "Cache lookups by cache and result", "counter",
+                  cache_lookup_samples)
+registry.callback("bluvoyage_cache_entries", "Entries in each in-memory cache tier", "gauge",
+                  cache_size_samples)
+
+async def generate_itinerary_response(user_input, budget=None):
+    budget = budget or Budget(REQUEST_BUDGET)
+    (music, movie, fashion, city, days), recs = await plan_trip(user_input, budget)
+    key = itinerary_cache_key(music, movie, fashion, city, days, recs)
+    return await itinerary_cache.get_or_set(
+        key,
+        lambda: generate_itinerary(user_input, recs, city, days, budget),
+        should_store=is_success,
+    )
+
+def use_per_day(days):
+    return PER_DAY_MIN_DAYS > 0 and days >= PER_DAY_MIN_DAYS
+
+async def generate_day(user_input, recs, city, day, days, budget, slots, avoid=()):
+    """One day of a per-day itinerary, retrying just this day on failure.
+    Returns a DayPlan, or None once retries are exhausted."""
+    prompt = build_day_prompt(user_input, recs, city, day, days, avoid)
+    for attempt in range(PER_DAY_RETRIES + 1):
         try:
-            raw_json = json_match.group(0)
-            parsed = json.loads(raw_json)
-            final_response = await enrich_with_maps(parsed)
-            
-            print(f"\n=== FINAL RESPONSE CHECK ===")
-            print(f"Cultural connections in first activity:")
-            if final_response.get("travel_plan", {}).get("days"):
-                first_day = final_response["travel_plan"]["days"][0]
-                if first_day.get("activities"):
-                    first_activity = first_day["activities"][0]
-                    print(f"Connection: {first_activity.get('cultural_connection', 'None found')}")
-            print("=============================\n")
-            
-            return final_response
-        except Exception as e:
-            return {"error": f"JSON parse failed: {str(e)}", "raw_response": raw_json}
-    else:
-        return {"error": "No valid JSON found", "raw_response": streamed[:300]}
+            async with slots:
+                with span("generate"):
+                    response = await generate_content(
+                        prompt, timeout=budget.remaining(GEMINI_TIMEOUT), kind="day", generation_config=DAY_CONFIG
+                    )
+            with span("json_parse"):
+                try:
+                    plan = DayPlan.model_validate_json(response.text)
+                except ValueError:
+                    upstream_errors.inc(service="gemini", reason="bad_json")
+                    raise
+            plan.day = day
+            return plan
+        except UpstreamUnavailable:
+            # Shed calls would be shed again; give up on the day straight away
+            return None
+        except (asyncio.TimeoutError, ValueError, google_exceptions.GoogleAPICallError) as e:
+            logger.warning("Day %d attempt %d failed: %r", day, attempt + 1, e)
+    return None
 
-async def enrich_with_maps(parsed_data):
-    itinerary = parsed_data.get("itinerary", {})
-    city = itinerary.get("destination", "Tokyo")
-    duration = itinerary.get("duration", 1)
-    image_url = f"https://picsum.photos/seed/{city}/1200/800"
-
-    response = {
-        "status": "success",
-        "travel_plan": {
-            "destination": city,
-            "duration_days": duration,
-            "summary": f"{duration}-day cultural itinerary for {city}",
-            "travel_image": image_url,
-            "days": []
-        }
+def repeated_venue_days(day_plans):
+    """Days (after the first occurrence) that reuse a venue from an earlier day"""
+    seen, repeats = set(), []
+    for plan in day_plans:
+        venues = {normalize(act.location) for act in plan.activities}
+        if venues & seen:
+            repeats.append(plan.day)
+        seen |= venues
+    return repeats
+
+async def generate_itinerary_per_day(user_input, recs, city, days, budget):
+    slots = asyncio.Semaphore(PER_DAY_CONCURRENCY)
+    day_plans = await asyncio.gather(*[
+        generate_day(user_input, recs, city, day, days, budget, slots)
+        for day in range(1, days + 1)
+    ])
+    failed = [day for day, plan in enumerate(day_plans, 1) if plan is None]
+    if failed:
+        return {"error": f"Itinerary generation failed for day(s) {', '.join(map(str, failed))}"}
+
+    # One regeneration pass for days that reused another day's venue
+    repeats = repeated_venue_days(day_plans)
+    if repeats:
+        def venues_outside(day):
+            return [act.location for plan in day_plans if plan.day != day for act in plan.activities]
+        retried = await asyncio.gather(*[
+            generate_day(user_input, recs, city, day, days, budget, slots, avoid=venues_outside(day))
+            for day in repeats
+        ])
+        for day, plan in zip(repeats, retried):
+            if plan is not None:
+                day_plans[day - 1] = plan
+
+    parsed = ItineraryDocument(itinerary={"destination": city, "duration": days, "days": day_plans})
+    with span("enrich"):
+        return await enrich_with_maps(parsed)
+
+async def generate_itinerary(user_input, recs, city, days, budget):
+    if use_per_day(days):
+        return await generate_itinerary_per_day(user_input, recs, city, days, budget)
+    prompt = build_prompt(user_input, recs, city, days)
+
+    try:
+        with span("generate"):
+            response = await generate_content(
+                prompt, timeout=budget.remaining(GEMINI_TIMEOUT), kind="itinerary", generation_config=ITINERARY_CONFIG
+            )
+        raw_json = response.text
+    except asyncio.TimeoutError:
+        return {"error": "Itinerary generation timed out"}
+    except UpstreamUnavailable:
+        return {"error": "Itinerary generation is temporarily unavailable, please try again shortly"}
+    except google_exceptions.GoogleAPICallError as e:
+        return {"error": f"Itinerary generation failed: {e.message}"}
+    except ValueError as e:
+        # response.text raises when the candidate was blocked or empty
+        return {"error": f"No valid JSON found: {e}"}
+
+    try:
+        with span("json_parse"):
+            parsed = ItineraryDocument.model_validate_json(raw_json)
+    except ValueError as e:
+        upstream_errors.inc(service="gemini", reason="bad_json")
+        return {"error": f"JSON parse failed: {str(e)}", "raw_response": raw_json[:300]}
+
+    with span("enrich"):
+        final_response = await enrich_with_maps(parsed)
+
+    if logger.isEnabledFor(logging.DEBUG) and final_response["travel_plan"]["days"]:
+        first_day = final_response["travel_plan"]["days"][0]
+        if first_day["activities"]:
+            logger.debug("Cultural connection in first activity: %s",
+                         first_day["activities"][0]["cultural_connection"] or "None found")
+
+    return final_response
+
+class DayStreamParser:
+    """Incrementally scans streamed itinerary JSON and returns each entry of
+    the "days" array, as a DayPlan, as soon as its closing brace arrives"""
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._stack = []  # (bracket, key it was opened under)
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None
+        self._pending_key = None
+        self._day_start = None
+
+    def feed(self, text):
+        self.buffer += text
+        days = []
+        buf = self.buffer
+        for i in range(self._pos, len(buf)):
+            c = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._last_string = buf[self._string_start + 1:i]
+                continue
+            if c == '"':
+                self._in_string = True
+                self._string_start = i
+            elif c == ":":
+                self._pending_key = self._last_string
+            elif c == ",":
+                self._pending_key = None
+            elif c in "{[":
+                if c == "{" and self._stack and self._stack[-1] == ("[", "days"):
+                    self._day_start = i
+                self._stack.append((c, self._pending_key))
+                self._pending_key = None
+            elif c in "}]" and self._stack:
+                self._stack.pop()
+                if c == "}" and self._day_start is not None and self._stack and self._stack[-1] == ("[", "days"):
+                    days.append(DayPlan.model_validate_json(buf[self._day_start:i + 1]))
+                    self._day_start = None
+        self._pos = len(buf)
+        return days
+
+CATEGORY_ICONS = {
+    "music": "🎵", "film": "🎬", "fashion": "👗",
+    "dining": "🍽️", "hidden_gem": "💎"
+}
+DEFAULT_TIMES = ["09:00", "11:30", "13:00", "14:30", "16:30", "19:00"]
+
+def travel_plan_header(city, duration):
+    """Top-level travel_plan fields, without the days"""
+    return {
+        "destination": city,
+        "duration_days": duration,
+        "summary": f"{duration}-day cultural itinerary for {city}",
+        "travel_image": f"https://picsum.photos/seed/{city}/1200/800",
     }
 
-    default_times = ["09:00", "11:30", "13:00", "14:30", "16:30", "19:00"]
+def visit_order(activities, venues):
+    """Indices of activities in visiting order. Dining stays in its meal slot;
+    the activities between meals are reordered to shorten the walk between
+    them, when every one of them was found in the venue index."""
+    order = list(range(len(activities)))
+    anchors = [i for i, act in enumerate(activities) if act.category == "dining"]
+    bounds = [-1, *anchors, len(activities)]
+    for before, after in zip(bounds, bounds[1:]):
+        segment = list(range(before + 1, after))
+        if len(segment) < 2 or any(venues[i] is None for i in segment):
+            continue
+        start = venues[before].coords if before >= 0 and venues[before] else None
+        end = venues[after].coords if after < len(activities) and venues[after] else None
+        best = order_segment(start, [venues[i].coords for i in segment], end)
+        order[before + 1:after] = [segment[j] for j in best]
+    return order
 
-    for day in itinerary.get("days", []):
-        activities = []
-        day_activities = day.get("activities", day.get("items", []))
-        
-        for i, act in enumerate(day_activities):
-            location = act.get("location") or act.get("name", "Unknown")
-            time = act.get("time")
-            if not time or time == "TBD":
-                time = default_times[i] if i < len(default_times) else f"{9 + i * 2}:00"
-            
-            # Generate simple maps link
-            maps_link = generate_maps_link(location, city)
-            
-            activities.append({
-                "time": time,
-                "location": {
-                    "name": location,
-                    "maps_link": maps_link,
-                    "address": f"{location}, {city}"
-                },
-                "category": act.get("category", "general"),
-                "description": act.get("description", act.get("name", "")),
-                "cultural_connection": act.get("cultural_connection", ""),
-                "category_icon": {
-                    "music": "🎵", "film": "🎬", "fashion": "👗",
-                    "dining": "🍽️", "hidden_gem": "💎"
-                }.get(act.get("category", ""), "📍")
-            })
-        response["travel_plan"]["days"].append({
-            "day_number": day.get("day", 1),
-            "theme": day.get("theme", "Cultural day"),
-            "activities": activities
+def enrich_day(day, city):
+    city_venues = _venue_index.city(city)
+    venues = [
+        city_venues.match(act.location) if city_venues and act.location else None
+        for act in day.activities
+    ]
+    times = []
+    for i, act in enumerate(day.activities):
+        time = act.time
+        if not time or time == "TBD":
+            time = DEFAULT_TIMES[i] if i < len(DEFAULT_TIMES) else f"{9 + i * 2}:00"
+        times.append(time)
+
+    activities = []
+    # Reordered activities take over the time slots in their original order
+    for time, i in zip(times, visit_order(day.activities, venues)):
+        act, venue = day.activities[i], venues[i]
+        if venue is not None:
+            location = {
+                "name": venue.name,
+                "maps_link": venue_maps_link(venue),
+                "address": venue.address,
+                "coordinates": {"lat": venue.lat, "lng": venue.lng},
+                "verified": True,
+            }
+        else:
+            name = act.location or "Unknown"
+            location = {
+                "name": name,
+                "maps_link": generate_maps_link(name, city),
+                "address": f"{name}, {city}",
+                "verified": False,
+            }
+
+        activities.append({
+            "time": time,
+            "location": location,
+            "category": act.category,
+            "description": act.description,
+            "cultural_connection": act.cultural_connection,
+            "category_icon": CATEGORY_ICONS.get(act.category, "📍")
         })
-    return response
+    return {
+        "day_number": day.day,
+        "theme": day.theme,
+        "activities": activities
+    }
+
+async def stream_itinerary_events(user_input, budget=None):
+    """Same pipeline as generate_itinerary_response, but yields the plan header
+    and then each enriched day as soon as Gemini finishes writing it"""
+    budget = budget or Budget(REQUEST_BUDGET)
+    (music, movie, fashion, city, days), recs = await plan_trip(user_input, budget)
+    key = itinerary_cache_key(music, movie, fashion, city, days, recs)
+
+    cached = await itinerary_cache.get(key)
+    if cached is not None:
+        plan = dict(cached["travel_plan"])
+        cached_days = plan.pop("days")
+        yield {"type": "plan", "travel_plan": plan}
+        for day in cached_days:
+            yield {"type": "day", "day": day}
+        yield {"type": "done", "days": len(cached_days)}
+        return
+
+    travel_plan = travel_plan_header(city, days)
+    yield {"type": "plan", "travel_plan": dict(travel_plan)}
+
+    if use_per_day(days):
+        slots = asyncio.Semaphore(PER_DAY_CONCURRENCY)
+        tasks = [
+            asyncio.create_task(generate_day(user_input, recs, city, day, days, budget, slots))
+            for day in range(1, days + 1)
+        ]
+        enriched_days = []
+        try:
+            # Days are generated concurrently but sent in order
+            for day, task in enumerate(tasks, 1):
+                plan = await task
+                if plan is None:
+                    yield {"type": "error", "error": f"Itinerary generation failed for day {day}"}
+                    return
+                enriched = enrich_day(plan, city)
+                enriched_days.append(enriched)
+                yield {"type": "day", "day": enriched}
+        finally:
+            for task in tasks:
+                task.cancel()
+        travel_plan["days"] = enriched_days
+        await itinerary_cache.set(key, {"status": "success", "travel_plan": travel_plan})
+        yield {"type": "done", "days": len(enriched_days)}
+        return
+
+    prompt = build_prompt(user_input, recs, city, days)
+    parser = DayStreamParser()
+    enriched_days = []
+    try:
+        async for text in stream_content(
+            prompt, timeout=budget.remaining(GEMINI_TIMEOUT), generation_config=ITINERARY_CONFIG
+        ):
+            try:
+                parsed_days = parser.feed(text)
+            except ValueError as e:
+                upstream_errors.inc(service="gemini", reason="bad_json")
+                yield {"type": "error", "error": f"JSON parse failed: {str(e)}"}
+                return
+            for day in parsed_days:
+                enriched = enrich_day(day, city)
+                enriched_days.append(enriched)
+                yield {"type": "day", "day": enriched}
+    except asyncio.TimeoutError:
+        yield {"type": "error", "error": "Itinerary generation timed out"}
+        return
+    except UpstreamUnavailable:
+        yield {"type": "error", "error": "Itinerary generation is temporarily unavailable, please try again shortly"}
+        return
+    except google_exceptions.GoogleAPICallError as e:
+        yield {"type": "error", "error": f"Itinerary generation failed: {e.message}"}
+        return
+
+    if not enriched_days:
+        yield {"type": "error", "error": "No valid JSON found", "raw_response": parser.buffer[:300]}
+        return
+
+    travel_plan["days"] = enriched_days
+    await itinerary_cache.set(key, {"status": "success", "travel_plan": travel_plan})
+    yield {"type": "done", "days": len(enriched_days)}
+
+async def enrich_with_maps(parsed_data):
+    itinerary = parsed_data.itinerary
+    city = itinerary.destination
+
+    travel_plan = travel_plan_header(city, itinerary.duration)
+    travel_plan["days"] = [enrich_day(day, city) for day in itinerary.days]
+    return {"status": "success", "travel_plan": travel_plan}
@@ -0,0 +1,176 @@
+import asyncio
+import random
+import time
+
+from metrics import registry
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+shed_total = registry.counter(
+    "bluvoyage_upstream_shed_total", "Upstream calls not attempted, by reason (rate_limited, breaker_open)"
+)
+retries_total = registry.counter("bluvoyage_upstream_retries_total", "Upstream calls retried after a failure")
+
+
+class UpstreamUnavailable(Exception):
+    """The call was shed without reaching the provider: its breaker is open or
+    its rate limit could not be met in time. Callers should degrade, not retry."""
+
+
+class TokenBucket:
+    """Allows rate calls per second on average with bursts of up to burst"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, max_wait):
+        """Take a token, waiting up to max_wait seconds for one. Returns False
+        if none would be available in time. Waiters reserve tokens up front,
+        so the bucket goes negative instead of admitting more than rate."""
+        if self.rate <= 0:
+            return True
+        self._refill()
+        wait = (1 - self.tokens) / self.rate
+        if wait > max_wait:
+            return False
+        self.tokens -= 1
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return True
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures and sheds calls for
+    reset_timeout seconds, then lets a single trial call through"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    def allow(self):
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_running or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial_running = False
+
+    def release(self):
+        """The call allowed through never reached the provider"""
+        self._trial_running = False
+
+
+class Upstream:
+    """Shared call path for one provider: a token bucket for its quota, bounded
+    retries with exponential backoff and full jitter, and a circuit breaker per
+    endpoint. is_retryable(exc) decides which failures are worth another try;
+    anything it rejects counts as a success for the breaker (e.g. a 404)."""
+
+    def __init__(self, service, rate, burst, max_wait=1.0, retries=2, backoff=0.2, max_backoff=2.0,
+                 failure_threshold=5, reset_timeout=30, is_retryable=None):
+        self.service = service
+        self.bucket = TokenBucket(rate, burst)
+        self.max_wait = max_wait
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_retryable = is_retryable or (lambda exc: True)
+        self.breakers = {}
+
+    def breaker(self, endpoint):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def is_open(self, endpoint):
+        return self.breaker(endpoint).state == OPEN
+
+    def _shed(self, endpoint, reason):
+        shed_total.inc(service=self.service, endpoint=endpoint, reason=reason)
+        raise UpstreamUnavailable(f"{self.service} {endpoint}: {reason}")
+
+    async def call(self, endpoint, factory, timeout=None):
+        """Await factory() under the rate limit, retrying and tripping the
+        endpoint's breaker as needed. timeout bounds the whole call, including
+        rate-limit waits and backoff sleeps; each attempt gets what is left."""
+        breaker = self.breaker(endpoint)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining():
+            return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        for attempt in range(self.retries + 1):
+            trial = breaker.state != CLOSED
+            if not breaker.allow():
+                self._shed(endpoint, "breaker_open")
+            max_wait = self.max_wait if deadline is None else min(self.max_wait, remaining())
+            if not await self.bucket.acquire(max_wait):
+                if trial:
+                    breaker.release()
+                self._shed(endpoint, "rate_limited")
+            try:
+                result = await asyncio.wait_for(factory(), remaining())
+            except asyncio.CancelledError:
+                if trial:
+                    breaker.release()
+                raise
+            except Exception as e:
+                if not self.is_retryable(e):
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                left = remaining()
+                if attempt == self.retries or (left is not None and delay >= left):
+                    raise
+                retries_total.inc(service=self.service, endpoint=endpoint)
+                await asyncio.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+    def state_samples(self):
+        for endpoint, breaker in self.breakers.items():
+            yield {"service": self.service, "endpoint": endpoint}, STATE_VALUES[breaker.state]
+
+
+def register_breaker_metrics(*upstreams):
+    registry.callback(
+        "bluvoyage_circuit_breaker_state", "Breaker state per upstream endpoint (0 closed, 1 half-open, 2 open)",
+        "gauge", lambda: [sample for upstream in upstreams for sample in upstream.state_samples()],
+    )
@@ -0,0 +1,74 @@
+from typing import List, Optional
+from pydantic import BaseModel
+
+# Typed views of Gemini's JSON output. Defaults keep a slightly incomplete
+# answer usable instead of failing the whole itinerary.
+
+class Activity(BaseModel):
+    time: Optional[str] = None
+    location: str = "Unknown"
+    category: str = "general"
+    description: str = ""
+    cultural_connection: str = ""
+
+class DayPlan(BaseModel):
+    day: int = 1
+    theme: str = "Cultural day"
+    activities: List[Activity] = []
+
+class Itinerary(BaseModel):
+    destination: str = "Tokyo"
+    duration: int = 1
+    days: List[DayPlan] = []
+
+class ItineraryDocument(BaseModel):
+    itinerary: Itinerary
+
+class ParsedInput(BaseModel):
+    music: str = "BTS"
+    movie: str = "Spirited Away"
+    fashion: str = "Uniqlo"
+    destination: str = "Tokyo"
+    days: int = 2
+
+# Matching response_schema definitions for Gemini's JSON mode (OpenAPI subset)
+
+def _object(properties, required=None):
+    return {
+        "type": "OBJECT",
+        "properties": properties,
+        "required": required if required is not None else list(properties),
+    }
+
+_STRING = {"type": "STRING"}
+_INTEGER = {"type": "INTEGER"}
+
+ACTIVITY_SCHEMA = _object({
+    "time": _STRING,
+    "location": _STRING,
+    "category": _STRING,
+    "description": _STRING,
+    "cultural_connection": _STRING,
+})
+
+DAY_SCHEMA = _object({
+    "day": _INTEGER,
+    "theme": _STRING,
+    "activities": {"type": "ARRAY", "items": ACTIVITY_SCHEMA},
+})
+
+ITINERARY_SCHEMA = _object({
+    "itinerary": _object({
+        "destination": _STRING,
+        "duration": _INTEGER,
+        "days": {"type": "ARRAY", "items": DAY_SCHEMA},
+    }),
+})
+
+PARSED_INPUT_SCHEMA = _object({
+    "music": _STRING,
+    "movie": _STRING,
+    "fashion": _STRING,
+    "destination": _STRING,
+    "days": _INTEGER,
+})
@@ -0,0 +1,52 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from metrics import stage_seconds
+
+# Spans recorded while handling the current request (None outside a request)
+current_timings = ContextVar("current_timings", default=None)
+
+
+class Budget:
+    """Single end-to-end deadline that every stage of a request draws from"""
+
+    def __init__(self, seconds):
+        self.deadline = time.monotonic() + seconds
+
+    def remaining(self, cap=None):
+        left = max(0.0, self.deadline - time.monotonic())
+        return left if cap is None else min(left, cap)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.spans = []
+
+    def add(self, name, seconds):
+        self.spans.append((name, seconds))
+
+    def totals(self):
+        """Seconds per stage, in first-seen order; repeated stages are summed"""
+        totals = {}
+        for name, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def server_timing(self):
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.totals().items())
+
+
+@contextmanager
+def span(name):
+    """Time a pipeline stage into the stage histogram and the current
+    request's timings, if any"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stage_seconds.observe(seconds, stage=name)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add(name, seconds)
@@ -0,0 +1,239 @@
+"""Offline venue index used to ground itineraries in real places.
+
+    python -m venues build --city Tokyo --city Kyoto --out venues.sqlite3   # needs GOOGLE_MAPS_API_KEY
+    python -m venues import venues.json --out venues.sqlite3
+
+Point VENUE_DB_PATH at the file. The server loads it once at startup; lookups
+are in memory after that.
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import re
+import sqlite3
+import unicodedata
+
+# Token overlap (Jaccard) a fuzzy match needs to be accepted
+MIN_MATCH_SCORE = 0.6
+# Words that say what a venue is rather than which one it is
+STOPWORDS = {"the", "a", "an", "of", "and", "at", "in", "de", "la", "le", "&"}
+
+# Places text-search queries per activity category, used by `build`
+CATEGORY_QUERIES = {
+    "music": ["live music venue", "record store", "jazz bar"],
+    "film": ["independent cinema", "film museum", "movie filming location"],
+    "fashion": ["concept store", "designer boutique", "vintage clothing store"],
+    "dining": ["local restaurant", "izakaya", "cafe"],
+    "hidden_gem": ["hidden gem", "art gallery", "historic alley"],
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS venues (
+    city TEXT NOT NULL,
+    name TEXT NOT NULL,
+    aliases TEXT NOT NULL,
+    category TEXT NOT NULL,
+    lat REAL NOT NULL,
+    lng REAL NOT NULL,
+    address TEXT NOT NULL,
+    place_id TEXT,
+    PRIMARY KEY (city, name)
+)
+"""
+
+
+def normalize_name(text):
+    """Casefolded, accent-free, punctuation-free form used for matching"""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+def tokens(text):
+    return frozenset(t for t in normalize_name(text).split() if t not in STOPWORDS)
+
+
+def haversine_km(a, b):
+    lat1, lng1, lat2, lng2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 12742 * math.asin(math.sqrt(h))
+
+
+class Venue:
+    __slots__ = ("name", "category", "lat", "lng", "address", "place_id")
+
+    def __init__(self, name, category, lat, lng, address, place_id=None):
+        self.name = name
+        self.category = category
+        self.lat = lat
+        self.lng = lng
+        self.address = address
+        self.place_id = place_id
+
+    @property
+    def coords(self):
+        return self.lat, self.lng
+
+
+class CityVenues:
+    """Venues of one destination with an exact alias map and a token
+    inverted index, so matching only scores venues sharing a word"""
+
+    def __init__(self):
+        self.venues = []
+        self.by_alias = {}
+        self.by_token = {}
+        self.venue_tokens = []
+
+    def add(self, venue, aliases):
+        i = len(self.venues)
+        self.venues.append(venue)
+        names = [venue.name, *aliases]
+        venue_tokens = frozenset().union(*(tokens(n) for n in names))
+        self.venue_tokens.append(venue_tokens)
+        for name in names:
+            self.by_alias.setdefault(normalize_name(name), i)
+        for token in venue_tokens:
+            self.by_token.setdefault(token, []).append(i)
+
+    def match(self, name):
+        exact = self.by_alias.get(normalize_name(name))
+        if exact is not None:
+            return self.venues[exact]
+        wanted = tokens(name)
+        candidates = {i for token in wanted for i in self.by_token.get(token, ())}
+        best, best_score = None, MIN_MATCH_SCORE - 1e-9
+        # Sorted so ties go to the venue listed first in the index
+        for i in sorted(candidates):
+            have = self.venue_tokens[i]
+            score = len(wanted & have) / len(wanted | have)
+            if score > best_score:
+                best, best_score = self.venues[i], score
+        return best
+
+    def by_category(self, category, limit):
+        return [v for v in self.venues if v.category == category][:limit]
+
+
+class VenueIndex:
+    def __init__(self):
+        self.cities = {}
+
+    def __len__(self):
+        return sum(len(c.venues) for c in self.cities.values())
+
+    def city(self, city):
+        return self.cities.get(normalize_name(city))
+
+    def add(self, city, venue, aliases=()):
+        self.cities.setdefault(normalize_name(city), CityVenues()).add(venue, aliases)
+
+    @classmethod
+    def load(cls, path):
+        """Read a whole index file; the file is memory-mapped while it is scanned"""
+        index = cls()
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            conn.execute("PRAGMA mmap_size=268435456")
+            rows = conn.execute(
+                "SELECT city, name, aliases, category, lat, lng, address, place_id FROM venues ORDER BY rowid"
+            )
+            for city, name, aliases, category, lat, lng, address, place_id in rows:
+                index.add(city, Venue(name, category, lat, lng, address, place_id), json.loads(aliases))
+        finally:
+            conn.close()
+        return index
+
+
+def route_length(points):
+    return sum(haversine_km(a, b) for a, b in zip(points, points[1:]))
+
+
+def order_segment(start, stops, end):
+    """Order of stops (a list of (lat, lng)), as indices into it, minimizing
+    the walk from start to end; either anchor may be None. Segments hold at
+    most a few stops, so trying every order is both exact and cheap."""
+    best, best_length = list(range(len(stops))), math.inf
+    if len(stops) < 2:
+        return best
+    anchors_before = [start] if start is not None else []
+    anchors_after = [end] if end is not None else []
+    for order in itertools.permutations(range(len(stops))):
+        length = route_length(anchors_before + [stops[i] for i in order] + anchors_after)
+        if length < best_length:
+            best, best_length = list(order), length
+    return best
+
+
+def write_index(path, rows):
+    """rows: dicts with city, name, category, lat, lng, address, optional aliases/place_id"""
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute(SCHEMA)
+        conn.executemany(
+            "INSERT OR REPLACE INTO venues (city, name, aliases, category, lat, lng, address, place_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (r["city"], r["name"], json.dumps(r.get("aliases", []), ensure_ascii=False), r["category"],
+                 r["lat"], r["lng"], r["address"], r.get("place_id"))
+                for r in rows
+            ],
+        )
+    conn.close()
+
+
+def fetch_city(client, city, per_query):
+    """Venue rows for one city from Places text search"""
+    rows, seen = [], set()
+    for category, queries in CATEGORY_QUERIES.items():
+        for query in queries:
+            results = client.places(query=f"{query} in {city}").get("results", [])
+            for place in results[:per_query]:
+                if place["place_id"] in seen:
+                    continue
+                seen.add(place["place_id"])
+                location = place["geometry"]["location"]
+                # "Blue Note Tokyo" is usually written "Blue Note" in a Tokyo itinerary
+                short = re.sub(rf"\b{re.escape(city)}\b", "", place["name"], flags=re.IGNORECASE).strip(" -,")
+                rows.append({
+                    "city": city,
+                    "name": place["name"],
+                    "aliases": [short] if short and short != place["name"] else [],
+                    "category": category,
+                    "lat": location["lat"],
+                    "lng": location["lng"],
+                    "address": place.get("formatted_address", f"{place['name']}, {city}"),
+                    "place_id": place["place_id"],
+                })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="fetch venues from the Google Places API")
+    build.add_argument("--city", action="append", required=True)
+    build.add_argument("--per-query", type=int, default=10)
+    build.add_argument("--out", default="venues.sqlite3")
+    load = commands.add_parser("import", help="load venues from a JSON list of rows")
+    load.add_argument("path")
+    load.add_argument("--out", default="venues.sqlite3")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        import googlemaps
+        from dotenv import load_dotenv
+        load_dotenv()
+        client = googlemaps.Client(key=os.getenv("GOOGLE_MAPS_API_KEY"))
+        rows = [row for city in args.city for row in fetch_city(client, city, args.per_query)]
+    else:
+        with open(args.path, encoding="utf-8") as f:
+            rows = json.load(f)
+    write_index(args.out, rows)
+    print(f"wrote {len(rows)} venues to {args.out}")
+
+
+if __name__ == "__main__":
+    main()